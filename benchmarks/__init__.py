@@ -0,0 +1,8 @@
+"""Load benchmarks for flaskr.
+
+dataset.py seeds a database with a reproducible synthetic set of users and posts.
+run.py drives the real endpoints against it, and reports throughput and latency percentiles as JSON.
+
+Run it from the root of the repository with:
+    python -m benchmarks.run --help
+"""
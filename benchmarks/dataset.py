@@ -0,0 +1,77 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import datetime
+import itertools # Used to split rows into batches
+import random # A seeded generator makes the dataset the same on every run
+
+from flaskr.blog import make_excerpt
+from flaskr.database import get_database, init_database
+from flaskr.hashing import hash_password
+
+
+#########################################################################################
+#################################### Dataset ############################################
+#########################################################################################
+
+# Every synthetic user has this password, so the benchmark can log in as any of them
+PASSWORD = 'password'
+
+# Words used to build titles and bodies
+WORDS = (
+    'flask sqlite index cursor page post user blog query cache stream worker request response '
+    'template render latency throughput commit write read table column hash login session'
+).split()
+
+def post_author(post_id, users):
+    """Returns the id of the user who wrote a post. Posts are shared out between users in turn"""
+    return (post_id - 1) % users + 1
+
+def user_posts(user_id, users, posts):
+    """Returns the ids of every post written by a user"""
+    return range(user_id, posts + 1, users)
+
+def generate_posts(posts, users, body_words, body_sigma, seed):
+    """Yields (id, author_id, created, title, body, excerpt, word_count) for every post.
+
+    Body lengths follow a log-normal distribution, with a median of body_words words.
+    body_sigma controls how spread out the lengths are, where 0 makes every body the same length.
+    Posts are spread over the year before 2026-01-01, with the newest post having the highest id.
+    """
+    generator = random.Random(seed)
+    start = datetime.datetime(2025, 1, 1)
+    step = datetime.timedelta(days=365) / max(posts, 1)
+
+    for post_id in range(1, posts + 1):
+        length = max(1, int(generator.lognormvariate(0, body_sigma) * body_words))
+        title = ' '.join(generator.choices(WORDS, k=4))
+        body = ' '.join(generator.choices(WORDS, k=length))
+        created = (start + step * post_id).strftime('%Y-%m-%d %H:%M:%S')
+        yield (post_id, post_author(post_id, users), created, title, body, *make_excerpt(body))
+
+def seed(users=100, posts=10000, body_words=100, body_sigma=0.5, seed=0, batch_size=10000):
+    """Resets the database of the current application, and fills it with users and posts.
+    Every user is called user<id>, and has the password PASSWORD.
+    """
+    init_database()
+    database = get_database()
+
+    # Hashing is slow, so the same hash is used for every user
+    password_hash = hash_password(PASSWORD)
+    database.executemany(
+        'INSERT INTO user (id, username, password) VALUES (?, ?, ?)',
+        ((user_id, f'user{user_id}', password_hash) for user_id in range(1, users + 1))
+    )
+
+    rows = generate_posts(posts, users, body_words, body_sigma, seed)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        database.executemany(
+            'INSERT INTO post (id, author_id, created, title, body, excerpt, word_count)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?)', batch
+        )
+
+    database.commit()
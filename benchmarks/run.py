@@ -0,0 +1,294 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import argparse
+import http.cookiejar
+import json
+import os
+import resource # Reports the peak memory used by the run
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks import dataset
+from flaskr import create_app
+
+
+#########################################################################################
+#################################### Sessions ###########################################
+#########################################################################################
+
+class ClientSession:
+    """Sends requests through the Flask test client, so no network or server is involved"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post(self, path, data):
+        return self.client.post(path, data=data).status_code
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Stops urllib following redirects, so each request is timed on its own"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """The local server's request handler, without a log line for every request"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class HTTPSession:
+    """Sends requests over HTTP to a local server, keeping cookies between requests"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    def _open(self, request):
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error: # Redirects and errors are still responses
+            error.read()
+            return error.code
+
+    def get(self, path):
+        return self._open(self.base_url + path)
+
+    def post(self, path, data):
+        return self._open(urllib.request.Request(
+            self.base_url + path, data=urllib.parse.urlencode(data).encode(), method='POST'
+        ))
+
+#########################################################################################
+#################################### Scenarios ##########################################
+#########################################################################################
+
+class Worker:
+    """The state of one benchmark thread. Each worker logs in as a different user"""
+
+    def __init__(self, session, number, options):
+        self.session = session
+        self.user_id = number % options.users + 1
+        self.posts = list(dataset.user_posts(self.user_id, options.users, options.posts))
+        self.count = 0 # How many requests this worker has sent
+
+    def login(self):
+        return self.session.post(
+            '/auth/login', {'username': f'user{self.user_id}', 'password': dataset.PASSWORD}
+        )
+
+    def next_post(self):
+        """Returns the id of the next post written by this worker's user"""
+        return self.posts[self.count % len(self.posts)]
+
+def index(worker):
+    return worker.session.get('/')
+
+def author(worker):
+    return worker.session.get(f'/user/user{worker.user_id}')
+
+def login(worker):
+    return worker.login()
+
+def create(worker):
+    return worker.session.post('/create', {'title': 'benchmark', 'body': 'benchmark post'})
+
+def update(worker):
+    return worker.session.post(f'/{worker.next_post()}/update', {'title': 'updated', 'body': 'updated post'})
+
+def delete(worker):
+    return worker.session.post(f'/{worker.next_post()}/delete', {})
+
+# Each scenario is a function which sends one request, and if the worker needs to log in first
+SCENARIOS = {
+    'index': (index, False),
+    'author': (author, False),
+    'login': (login, False),
+    'create': (create, True),
+    'update': (update, True),
+    'delete': (delete, True),
+}
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def percentile(latencies, percent):
+    """Returns the nearest-rank percentile of a sorted list of latencies"""
+    if not latencies:
+        return 0.0
+    rank = max(1, round(percent / 100 * len(latencies)))
+    return latencies[rank - 1]
+
+def run_scenario(name, make_session, options):
+    """Runs one scenario on options.threads threads, and returns its results"""
+    scenario, needs_login = SCENARIOS[name]
+    per_thread = max(1, options.requests // options.threads)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    workers = [Worker(make_session(), number, options) for number in range(options.threads)]
+    if needs_login:
+        for worker in workers:
+            worker.login()
+
+    # Deleting a post twice is a 404, so delete can send at most one request per post
+    if name == 'delete':
+        per_thread = min(per_thread, min(len(worker.posts) for worker in workers))
+
+    def work(worker):
+        timings = []
+        failures = 0
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            status = scenario(worker)
+            timings.append(time.perf_counter() - start)
+            worker.count += 1
+            if status >= 400:
+                failures += 1
+        with lock:
+            latencies.extend(timings)
+            errors.append(failures)
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in workers]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regressions against a baseline run.
+    A scenario has regressed if its throughput fell, or its p95 latency rose, by more than tolerance.
+    """
+    regressions = []
+    for name, result in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        if result['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput']:.1f} -> {result['throughput']:.1f} req/s")
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms")
+    return regressions
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark the flaskr endpoints against a synthetic dataset.')
+    parser.add_argument('--users', type=int, default=100, help='users in the dataset')
+    parser.add_argument('--posts', type=int, default=10000, help='posts in the dataset')
+    parser.add_argument('--body-words', type=int, default=100, help='median words in a post body')
+    parser.add_argument('--body-sigma', type=float, default=0.5, help='spread of post body lengths')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the dataset generator')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated scenarios to run, in order')
+    parser.add_argument('--requests', type=int, default=1000, help='requests sent for each scenario')
+    parser.add_argument('--threads', type=int, default=8, help='threads sending requests at once')
+    parser.add_argument('--mode', choices=('client', 'http'), default='client',
+                        help='send requests through the test client, or over HTTP to a local threaded server')
+    parser.add_argument('--idle', type=int, default=0,
+                        help='in http mode, idle keep-alive connections held open to the server during the run')
+    parser.add_argument('--hash-method', default='scrypt', help='PASSWORD_HASH_METHOD for the app')
+    parser.add_argument('--config', type=json.loads, default={}, help='extra app config, as a JSON object')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed regression against the baseline')
+    return parser.parse_args(arguments)
+
+def main(arguments=None):
+    options = parse_arguments(arguments)
+    directory = tempfile.mkdtemp(prefix='flaskr-benchmark-')
+
+    app = create_app({
+        'DATABASE': os.path.join(directory, 'benchmark.sqlite'),
+        'PAGE_CACHE_PATH': os.path.join(directory, 'cache.sqlite'),
+        'PASSWORD_HASH_METHOD': options.hash_method,
+        'LOGIN_THROTTLE_BACKEND': None, # Every worker logs in from the same address, so it would be throttled
+        'LOGIN_THROTTLE_PATH': os.path.join(directory, 'throttle.sqlite'),
+        **options.config,
+    })
+
+    with app.app_context():
+        dataset.seed(options.users, options.posts, options.body_words, options.body_sigma, options.seed)
+
+    server = None
+    if options.mode == 'http':
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        make_session = lambda: HTTPSession(base_url)
+
+        # Idle clients connect and then send nothing, as a browser holding a keep-alive connection open would
+        idle = [socket.create_connection(('127.0.0.1', server.server_port)) for _ in range(options.idle)]
+    else:
+        make_session = lambda: ClientSession(app)
+
+    results = {
+        'options': {key: value for key, value in vars(options).items() if key not in ('output', 'baseline')},
+        'scenarios': {},
+    }
+    memory_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        for name in options.scenarios.split(','):
+            result = run_scenario(name, make_session, options)
+            results['scenarios'][name] = result
+            print(f"{name:>8}: {result['throughput']:8.1f} req/s  p50 {result['p50_ms']:7.2f} ms"
+                  f"  p95 {result['p95_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  errors {result['errors']}")
+    finally:
+        if server is not None:
+            for connection in idle:
+                connection.close()
+            server.shutdown()
+
+    # ru_maxrss is in kilobytes on Linux. The server runs in this process, so this includes its threads
+    results['peak_memory_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['memory_growth_kb'] = results['peak_memory_kb'] - memory_before
+    print(f"peak memory {results['peak_memory_kb']} KB, grew {results['memory_growth_kb']} KB during the run")
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            regressions = compare(results, json.load(file), options.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def measure(directory):
+    """Runs in a fresh Python process, and times each stage of starting the app up to its first request.
+    Returns the times in milliseconds.
+    """
+    start = time.perf_counter()
+    from flaskr import create_app
+    from flaskr.database import init_database
+    imported = time.perf_counter()
+
+    app = create_app({
+        'DATABASE': os.path.join(directory, 'startup.sqlite'),
+        'PAGE_CACHE_BACKEND': None, # Otherwise the second request would be a cache hit
+        'JINJA_BYTECODE_CACHE': os.path.join(directory, 'jinja_cache'),
+    })
+    created = time.perf_counter()
+
+    # Setting up the database is not part of starting up, so it is not timed
+    with app.app_context():
+        init_database()
+    client = app.test_client()
+
+    times = []
+    for _ in range(2):
+        before = time.perf_counter()
+        client.get('/')
+        times.append(time.perf_counter() - before)
+
+    return {
+        'import_ms': (imported - start) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'first_request_ms': times[0] * 1000,
+        'second_request_ms': times[1] * 1000,
+    }
+
+def run_child(directory):
+    """Starts a new Python process which runs measure(), and returns its times"""
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.startup', '--child', directory],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output)
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Measure how long flaskr takes to import, start and serve its first request.')
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes to start for each case')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--child', help=argparse.SUPPRESS) # Used by the parent to start a measurement
+    options = parser.parse_args(arguments)
+
+    if options.child:
+        print(json.dumps(measure(options.child)))
+        return 0
+
+    directory = tempfile.mkdtemp(prefix='flaskr-startup-')
+    cache = os.path.join(directory, 'jinja_cache')
+    results = {}
+
+    # cold clears the bytecode cache before every run, as after a deploy. warm keeps it, as after 'flask warmup'
+    for case in ('cold', 'warm'):
+        runs = []
+        for _ in range(options.runs):
+            if case == 'cold':
+                shutil.rmtree(cache, ignore_errors=True)
+            runs.append(run_child(directory))
+
+        results[case] = {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+        print(f'{case:>5}: ' + '  '.join(f'{name} {value:7.2f}' for name, value in results[case].items()))
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
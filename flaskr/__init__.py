@@ -21,6 +21,52 @@ def create_app(test_config=None):
     app.config.from_mapping(    # The path where teh SQLite database file will be saved
         SECRET_KEY='dev',
         DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        STATS_VIEWS=False,    # Serve the counters of the connection pool, page cache and login throttle as JSON views
+        DATABASE_POOL_SIZE=8,    # The most idle database connections kept open by each process
+        DATABASE_STATEMENT_CACHE=256,    # The number of prepared statements kept by each connection
+        DATABASE_PRAGMAS={    # Settings run once on each new database connection
+            'journal_mode': 'WAL',    # Readers do not block writers, and writers do not block readers
+            'synchronous': 'NORMAL',    # Safe with WAL, and avoids a sync on every commit
+            'cache_size': -16000,    # 16MB of page cache. Negative numbers are in KB
+            'mmap_size': 268435456,    # Read up to 256MB of the file through memory mapping
+            'busy_timeout': 5000,    # Wait up to 5 seconds for a lock instead of failing with 'database is locked'
+            'foreign_keys': 'ON',    # Enforce the FOREIGN KEY on post.author_id
+        },
+        ASYNC_VIEWS=False,    # Serve the login and register pages with their async def views
+        ASYNC_DATABASE_WORKERS=4,    # Threads which run database work for the async views
+        WRITE_QUEUE=False,    # Send post writes to a single writer thread, which commits them in groups
+        WRITE_BATCH_SIZE=64,    # The most writes committed together by the writer
+        WRITE_MAX_WAIT=0.002,    # How many seconds the writer waits for more writes before committing
+        WRITE_TIMEOUT=10,    # How many seconds a request waits for the writer before it is sent a 503
+        EXCERPT_WORDS=50,    # The number of words from each post shown on the blog index
+        POSTS_PER_PAGE=20,    # The number of posts shown on each page of the blog index
+        JINJA_BYTECODE_CACHE=os.path.join(app.instance_path, 'jinja_cache'),    # Where compiled templates are saved, or None to not save them
+        API_MAX_AGE=10,    # How many seconds clients and CDNs may reuse an API response without asking again
+        INDEX_STREAMING=False,    # Send the blog index to the browser while it is being rendered
+        INDEX_STREAM_BUFFER=5,    # The number of template events grouped into each streamed chunk
+        PAGE_CACHE_BACKEND='memory',    # Where rendered pages are cached: 'memory', 'sqlite' or None to turn it off
+        PAGE_CACHE_PATH=os.path.join(app.instance_path, 'cache.sqlite'),    # The file used by the 'sqlite' cache
+        PAGE_CACHE_SIZE=256,    # The most pages kept in the cache
+        PAGE_CACHE_TTL=60,    # How many seconds a page is kept in the cache
+        USER_CACHE_SIZE=1024,    # The most logged in users kept in memory by each process
+        USER_CACHE_TTL=300,    # How many seconds a logged in user is kept in memory
+        LOGIN_THROTTLE_BACKEND='memory',    # Where login attempts are counted: 'memory', 'sqlite' or None to turn it off
+        LOGIN_THROTTLE_PATH=os.path.join(app.instance_path, 'throttle.sqlite'),    # The file used by the 'sqlite' throttle
+        LOGIN_THROTTLE_SIZE=10000,    # The most IP addresses and usernames tracked by the 'memory' throttle
+        LOGIN_THROTTLE_IP=(20, 60),    # Each IP address may make 20 login or register attempts, refilled over 60 seconds
+        LOGIN_THROTTLE_USERNAME=(5, 60),    # Each username may have 5 attempts, refilled over 60 seconds
+        METRICS_ENABLED=True,    # Measure requests, add Server-Timing headers and serve the totals at /metrics
+        METRICS_SAMPLE_RATE=1.0,    # The fraction of requests that are measured
+        METRICS_SLOWEST=5,    # How many of the slowest queries are kept
+        SLOW_QUERY_THRESHOLD=None,    # Log any query slower than this many seconds, or None to log nothing
+        COMPRESS_ENABLED=True,    # Gzip text responses for browsers which accept it
+        COMPRESS_LEVEL=6,    # The zlib level, from 1 (fastest) to 9 (smallest)
+        COMPRESS_MIN_SIZE=500,    # Responses smaller than this many bytes are not worth compressing
+        COMPRESS_MIMETYPES=('text/html', 'text/css', 'text/plain', 'text/javascript', 'application/json'),
+        PASSWORD_HASH_METHOD='scrypt',    # The werkzeug method and cost used to hash passwords, e.g. 'pbkdf2:sha256:600000'
+        HASHING_WORKERS=4,    # The most password hashes that run at once
+        HASHING_QUEUE_SIZE=16,    # How many more hashes may wait, before requests are turned away with a 503
+        HASHING_EXECUTOR='thread',    # Run hashes on a pool of 'thread's or 'process'es
     )
 
     """If a test config is given, then override the default configuration. 
@@ -46,13 +92,41 @@ def create_app(test_config=None):
         return 'Hello, World!'
     
     # Import modules from the root directory
-    from . import database, authentication, blog
+    # The group commit writer and the async views are only imported below if they are enabled
+    from . import startup, assets, metrics, compression, database, cache, throttle, hashing, authentication, blog, api
+    
+    # Saves compiled templates between restarts, and registers the warmup command
+    startup.init_app(app)
+    
+    # Sends static files under content hashed names, gzipped and cached for a year, once 'flask build-assets' has been run
+    assets.init_app(app)
+    
+    # Starts measuring requests. This is done first, so that the measurements cover everything else
+    metrics.init_app(app)
+    
+    # Gzips text responses. This is registered after metrics, so it runs before them and they include its time
+    compression.init_app(app)
     
     # This registers two functions with the application: 
     # - app.teardown_appcontext(close_db)   
     # - app.cli.add_command(init_db_command)
+    # It also registers the other database commands, such as upgrade-db, export and import
     database.init_app(app)
     
+    # Creates the page cache, and registers the cache-stats command (and /cache-stats if STATS_VIEWS is set)
+    cache.init_app(app)
+    
+    # Creates the group commit writer, if WRITE_QUEUE is enabled
+    if app.config['WRITE_QUEUE']:
+        from . import writer
+        writer.init_app(app)
+    
+    # Limits login and register attempts by IP address and username, before any database or hashing work
+    throttle.init_app(app)
+    
+    # Creates the pool of workers which hash passwords
+    hashing.init_app(app)
+    
     # Import and register blueprints
     app.register_blueprint(authentication.blueprint)
     
@@ -61,6 +135,14 @@ def create_app(test_config=None):
     # This makes the blog index the main index
     #  Associates the end-point name 'index' with the / url, so that url_for('index') or url_for('blog.index') both generate the same url
     app.add_url_rule('/', endpoint='index') 
+    
+    # The read only JSON API, at /api
+    app.register_blueprint(api.blueprint)
+    
+    # Swaps in the async views, if ASYNC_VIEWS is enabled
+    if app.config['ASYNC_VIEWS']:
+        from . import aio
+        aio.init_app(app)
 
 
     return app
\ No newline at end of file
@@ -0,0 +1,56 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import contextvars # Carries the app and request context over to the database threads
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+
+#########################################################################################
+#################################### Database ###########################################
+#########################################################################################
+
+class AsyncDatabase:
+    """Lets async views await database work, which runs on a dedicated pool of threads.
+
+    The work runs with a copy of the view's context, so it can use get_database(), g and current_app
+    just like a normal view. The request's connection is still only used by one thread at a time,
+    as the view waits for each piece of work to finish before starting the next.
+    """
+
+    def __init__(self, workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='database')
+
+    async def run(self, function, *args):
+        """Runs function(*args) on a database thread, and awaits its result"""
+        import asyncio # Already loaded by the time a view is awaited, so this is only a lookup
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, context.run, function, *args)
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def get_async_database():
+    """Returns the async database wrapper of the current application"""
+    return current_app.extensions['async_database']
+
+def init_app(app):
+    """Switches the login and register views to their async def versions, if ASYNC_VIEWS is enabled.
+
+    The URL rules stay the same, only the functions which handle them are swapped.
+    ASYNC_DATABASE_WORKERS is how many threads run database work for the async views.
+    Views wrapped by login_required stay synchronous, as the decorator cannot await a view.
+    The index stays synchronous too. It only waits on the database and the cache, and an
+    async version served fewer requests a second than the plain one.
+    """
+    if not app.config['ASYNC_VIEWS']:
+        return
+
+    from flaskr import authentication
+
+    app.extensions['async_database'] = AsyncDatabase(app.config['ASYNC_DATABASE_WORKERS'])
+    app.view_functions['auth.register'] = authentication.register_async
+    app.view_functions['auth.login'] = authentication.login_async
@@ -0,0 +1,113 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import datetime
+import hashlib # Used to turn a url into a short part of an ETag
+
+from flask import Blueprint, current_app, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from flaskr.blog import get_post, get_posts_page
+from flaskr.database import get_content_changes
+
+
+#########################################################################################
+#################################### Blueprint ##########################################
+#########################################################################################
+
+"""Blueprint for the read only JSON API.
+The API will:
+- list posts, a page at a time, at /api/posts
+- return a single post at /api/posts/<id>
+
+Every response carries an ETag and Last-Modified taken from the version of the posts,
+so clients and caches can ask if anything has changed without the posts being read.
+Errors are sent as JSON too, and the session is never read, so responses do not vary by cookie.
+"""
+blueprint = Blueprint('api', __name__, url_prefix='/api')
+
+@blueprint.errorhandler(HTTPException)
+def http_error(error):
+    """Sends errors, such as a missing post or a bad cursor, as JSON rather than as an HTML page"""
+    response = jsonify(error=error.name, description=error.description)
+    response.status_code = error.code
+    
+    # Keep any extra headers the error adds, such as Retry-After
+    for name, value in error.get_headers():
+        if name.lower() != 'content-type':
+            response.headers[name] = value
+    
+    return response
+
+#########################################################################################
+######################################## views ##########################################
+#########################################################################################
+
+@blueprint.route('/posts')
+def posts():
+    """Returns a page of posts, newest first, paged the same way as the blog index with ?before= and ?after="""
+    not_modified, headers = check_posts_changed()
+    if not_modified:
+        return '', 304, headers
+
+    page = get_posts_page(before=request.args.get('before'), after=request.args.get('after'))
+    response = jsonify(
+        posts=[post_json(post) for post in page.posts],
+        next=page.next_cursor,
+        previous=page.previous_cursor,
+    )
+    response.headers.update(headers)
+    return response
+
+@blueprint.route('/posts/<int:id>')
+def post(id):
+    """Returns a single post"""
+    not_modified, headers = check_posts_changed()
+    if not_modified:
+        return '', 304, headers
+
+    response = jsonify(post_json(get_post(id, check_author=False)))
+    response.headers.update(headers)
+    return response
+
+#########################################################################################
+######################################## Functions ######################################
+#########################################################################################
+
+def post_json(post):
+    """Turns a row from the post table into a dictionary which can be sent as JSON"""
+    post = dict(post)
+    post['created'] = post['created'].isoformat()
+    return post
+
+def check_posts_changed():
+    """Works out the caching headers for the current url from the version of the posts.
+
+    Returns True if the client's copy is still up to date, so a 304 can be sent,
+    along with the ETag, Last-Modified and Cache-Control headers for the response.
+    Only the content_version table is read, so this costs the same whatever the response holds.
+    """
+    version, changed = get_content_changes('post')
+
+    # The ETag is different for every url, so it includes the url as well as the version.
+    # It is weak, as the same posts may be sent gzipped or not, so the 200 and the 304 send the same ETag
+    url = hashlib.sha1(request.full_path.encode()).hexdigest()[:16]
+    etag = f'{version}-{url}'
+
+    headers = {
+        'ETag': f'W/"{etag}"',
+        'Cache-Control': f"public, max-age={current_app.config['API_MAX_AGE']}",
+    }
+
+    if changed is not None:
+        changed = changed.replace(tzinfo=datetime.timezone.utc) # CURRENT_TIMESTAMP is stored in UTC
+        headers['Last-Modified'] = changed.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+    # If-None-Match is more exact, so If-Modified-Since is only used when it is missing.
+    # If-None-Match always uses the weak comparison, so W/"..." and "..." both match
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag), headers
+    if request.if_modified_since is not None and changed is not None:
+        return changed <= request.if_modified_since, headers
+    return False, headers
@@ -0,0 +1,12 @@
+"""The ASGI entry point, for serving the app with an ASGI server such as uvicorn or hypercorn:
+
+    uvicorn flaskr.asgi:application
+
+asgiref is needed, which is installed with flask[async]. Set ASYNC_VIEWS in the instance config.py
+to serve the login and register pages with their async def views.
+"""
+from asgiref.wsgi import WsgiToAsgi
+
+from flaskr import create_app
+
+application = WsgiToAsgi(create_app())
@@ -0,0 +1,120 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import gzip
+import hashlib # Used to name each file after its contents
+import json
+import mimetypes
+import os
+
+import click
+from flask import current_app, request, send_from_directory
+
+
+#########################################################################################
+#################################### Assets #############################################
+#########################################################################################
+
+# Built files are written to this folder inside the static folder, along with a manifest
+# which maps each original file name to its built name, e.g. 'style.css' -> 'build/style.3f2a9c1b7e4d.css'
+BUILD_FOLDER = 'build'
+MANIFEST = 'manifest.json'
+
+# Built files never change, as a change gives them a new name. So browsers can keep them for a year
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def build_assets(static_folder):
+    """Writes a content hashed copy, and a gzipped copy of that, of every file in the static folder.
+    Returns the manifest of original names to built names.
+    """
+    build_folder = os.path.join(static_folder, BUILD_FOLDER)
+    os.makedirs(build_folder, exist_ok=True)
+    manifest = {}
+
+    for folder, folders, files in os.walk(static_folder):
+        # Don't build the files which have already been built
+        folders[:] = [name for name in folders if os.path.join(folder, name) != build_folder]
+
+        for name in files:
+            path = os.path.join(folder, name)
+            with open(path, 'rb') as file:
+                content = file.read()
+
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            stem, extension = os.path.splitext(filename)
+            built = f'{BUILD_FOLDER}/{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+            built_path = os.path.join(static_folder, built)
+            os.makedirs(os.path.dirname(built_path), exist_ok=True)
+
+            with open(built_path, 'wb') as file:
+                file.write(content)
+            # mtime=0 means building the same file twice gives exactly the same bytes
+            with open(built_path + '.gz', 'wb') as file:
+                file.write(gzip.compress(content, compresslevel=9, mtime=0))
+
+            manifest[filename] = built
+
+    with open(os.path.join(build_folder, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+
+    return manifest
+
+def load_manifest(static_folder):
+    """Returns the manifest written by build_assets(), or an empty one if the assets have not been built"""
+    try:
+        with open(os.path.join(static_folder, BUILD_FOLDER, MANIFEST)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def hashed_static_url(endpoint, values):
+    """Called by url_for. Swaps the name of a static file for its built name, if it has been built"""
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = current_app.extensions['assets'].get(values['filename'], values['filename'])
+
+def send_static(filename):
+    """Replaces Flask's static view.
+    Built files are sent gzipped if the browser accepts it, and can be cached forever.
+    Anything else is sent the same way Flask normally would.
+    """
+    if not filename.startswith(BUILD_FOLDER + '/'):
+        return current_app.send_static_file(filename)
+
+    static_folder = current_app.static_folder
+    # The quality is 0 if the browser refused gzip with 'gzip;q=0', and 1 for '*'
+    gzipped = request.accept_encodings['gzip'] > 0 and os.path.isfile(os.path.join(static_folder, filename + '.gz'))
+
+    if gzipped:
+        # download_name gives the name of the file once it is decompressed, not the name of the .gz file
+        response = send_from_directory(
+            static_folder, filename + '.gz', mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            download_name=os.path.basename(filename),
+        )
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_from_directory(static_folder, filename)
+
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary.add('Accept-Encoding')
+    return response
+
+def init_app(app):
+    """Loads the manifest of built assets, and makes url_for('static', ...) and the static view use it.
+    The manifest is read once when the app starts, so run 'flask build-assets' before starting workers.
+    """
+    app.extensions['assets'] = load_manifest(app.static_folder)
+    app.url_defaults(hashed_static_url)
+    app.view_functions['static'] = send_static
+    app.cli.add_command(build_assets_command)
+
+
+@click.command('build-assets')
+def build_assets_command():
+    """Defines a command line command called build-assets, which builds every file in the static folder."""
+    manifest = build_assets(current_app.static_folder)
+    click.echo(f'Built {len(manifest)} static files.')
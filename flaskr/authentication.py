@@ -3,12 +3,16 @@
 #########################################################################################
 
 import functools # Higher order functions and operations on callable objects
-from werkzeug.security import check_password_hash, generate_password_hash # Security related functions
+from flaskr.cache import MemoryCache # Used to keep recently loaded users in memory
 from flaskr.database import get_database # Import the function to get a connection to the database
+from flaskr.hashing import ( # Hashing runs on a separate pool of workers
+    check_password, check_password_async, hash_password, hash_password_async, needs_rehash
+)
+from flaskr.throttle import check_throttle # Turns away bursts of attempts before they reach the database
 
 # A blueprint is a way to organize a group of related views, or other code.
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, current_app, flash, g, redirect, render_template, request, session, url_for
 )
 
 #########################################################################################
@@ -24,6 +28,15 @@ url_prefix is put at the start of all urls associated with authentication
 """
 blueprint = Blueprint('auth', __name__, url_prefix='/auth')
 
+@blueprint.record_once
+def create_user_cache(state):
+    """When the blueprint is registered, create the cache of logged in users for the application.
+    The size and time to live are set by USER_CACHE_SIZE and USER_CACHE_TTL.
+    """
+    state.app.extensions['user_cache'] = MemoryCache(
+        state.app.config['USER_CACHE_SIZE'], state.app.config['USER_CACHE_TTL']
+    )
+
 #########################################################################################
 ###################################### Views ############################################
 #########################################################################################
@@ -36,42 +49,21 @@ def register():
     """
     
     if request.method == 'POST':   # If user submitted the form
-        # request.form[] is a type of dictionary mapping. 
-        username = request.form['username']
-        password = request.form['password']
-        
-        # Retrieve the database for storing user information
-        database = get_database()
+        # Reads the form, and raises a 429 error if this IP address or username has made too many attempts
+        username, password = read_credentials()
         
         # Will store any error from the result of input validation
-        error = None
-
-        # Validate user input.
-        # Check that they are not empty
-        if not username:
-            error = 'Username is required.'
-        elif not password:
-            error = 'Password is required.'
+        error = validate_registration(username, password)
 
         # If validation was successful, insert their data into the user table
         if error is None:
-            
-            # Try catch for error handling
-            try:
-                # takes SQL query 
-                # ? are placeholders for user input, tuple is what to replace the placeholders with
-                # The database library will automatically protect from SQL injection 
-                database.execute( 
-                    "INSERT INTO user (username, password) VALUES (?, ?)",
-                    (username, generate_password_hash(password)), # Password is hashed for security
-                )
-                database.commit() # Commit changes to the database
-            except database.IntegrityError: # If username is already in use
-                error = f"User {username} is already registered."
-            else: # If no exception, then redirect to login page
+            # Password is hashed for security
+            if create_user(username, hash_password(password)):
                 # url_for automatially generates the url for login based on name
                 # redirect then redirects the user to that url
                 return redirect(url_for("auth.login"))
+            
+            error = f"User {username} is already registered."
 
         # Flash stores messages that can be retrieved when rendering the template
         flash(error)
@@ -87,46 +79,85 @@ def login():
     """
     
     if request.method == 'POST': # If user submitted form   
-        # request.form[] is a type of dictionary mapping. 
-        username = request.form['username']
-        password = request.form['password']
-        
-        # Retrieve the database for storing user information
-        database = get_database()
+        # Reads the form, and raises a 429 error if this IP address or username has made too many attempts
+        username, password = read_credentials()
         
         # Will store any error from the result of input validation
         error = None
         
         # Retrieve user information
-        # SELECT [ALL] FROM the user table WHERE the username field = the provided username
-        user = database.execute(
-            'SELECT * FROM user WHERE username = ?', (username,)
-        ).fetchone()
-
+        user = find_user(username)
         
         if user is None: # A matching user could not be found
             error = 'Incorrect username.'
-        elif not check_password_hash(user['password'], password): # Password is hashed and checks if it matches what is stored
+        elif not check_password(user['password'], password): # Password is hashed and checks if it matches what is stored
             error = 'Incorrect password.' # The user could be found, but the password is incorrect
+        elif needs_rehash(user['password']):
+            # The password is correct, but was hashed with an old method or cost. 
+            # As we know the password now, it can be hashed again with the current settings
+            update_password(user['id'], hash_password(password))
         
         # Login was successful 
         if error is None:
-            # session is a dictionary that stores data across requests
-            # When validation succeeds the user id is stored in a new session. 
-            # Data is stored in a cookie that is sent to the browser, before being sent back with subsequent request
-            session.clear()
-            session['user_id'] = user['id']
-            
-            # url_for automatially generates a url for based on name
-            # redirect then redirects the user to that url
-            # If the user is logged in, then their information should be loaded and made available to other views
-            return redirect(url_for('index'))
+            return log_in(user)
 
         # Flash stores messages that can be retrieved when rendering the template
         flash(error)
 
     return render_template('authentication/login.html')
 
+async def register_async():
+    """The same as register(), but awaits the database and password hashing instead of blocking on them.
+    It is used in place of register() when ASYNC_VIEWS is enabled.
+    """
+    from flaskr.aio import get_async_database # Only imported when ASYNC_VIEWS is enabled
+
+    if request.method == 'POST':
+        database = get_async_database()
+        
+        # The throttle may use an SQLite file, so it is checked on a database thread too
+        username, password = await database.run(read_credentials)
+        error = validate_registration(username, password)
+
+        if error is None:
+            password_hash = await hash_password_async(password)
+            
+            if await database.run(create_user, username, password_hash):
+                return redirect(url_for("auth.login"))
+            
+            error = f"User {username} is already registered."
+
+        flash(error)
+
+    return render_template('authentication/register.html')
+
+async def login_async():
+    """The same as login(), but awaits the database and password hashing instead of blocking on them.
+    It is used in place of login() when ASYNC_VIEWS is enabled.
+    """
+    from flaskr.aio import get_async_database # Only imported when ASYNC_VIEWS is enabled
+
+    if request.method == 'POST':
+        database = get_async_database()
+        username, password = await database.run(read_credentials)
+        error = None
+        
+        user = await database.run(find_user, username)
+
+        if user is None:
+            error = 'Incorrect username.'
+        elif not await check_password_async(user['password'], password):
+            error = 'Incorrect password.'
+        elif needs_rehash(user['password']):
+            await database.run(update_password, user['id'], await hash_password_async(password))
+        
+        if error is None:
+            return log_in(user)
+
+        flash(error)
+
+    return render_template('authentication/login.html')
+
 @blueprint.route('/logout')
 def logout():
     """A view for logging the user out.
@@ -139,16 +170,119 @@ def logout():
 # Registers a function that runs before the view function, regardless of requested url
 @blueprint.before_app_request
 def load_logged_in_user():
+    """Loads the logged in user into g.user, or sets it to None if no one is logged in. 
+    Users are kept in a cache, so most requests do not need to query the database.
+    """
+    # Static files and the API never use the user, so don't bother loading them.
+    # Reading the session would also add Vary: Cookie, which stops shared caches storing API responses
+    if request.endpoint == 'static' or request.blueprint == 'api':
+        g.user = None
+        return
+    
     # user_id is stored as a cookie for the session
     user_id = session.get('user_id')
 
     if user_id is None: # If user is not logged in, then set g.user to none
         g.user = None
-    else: # if user has been logged in, then retrieve their user information from the database
-        g.user = get_database().execute(
-            'SELECT * FROM user WHERE id = ?', (user_id,)
+    else: # if user has been logged in, then retrieve their user information
+        g.user = get_user(user_id)
+
+#########################################################################################
+###################################### Functions ########################################
+#########################################################################################
+
+def read_credentials():
+    """Returns the username and password from the submitted form.
+    Raises a 429 error if this IP address or username has made too many attempts, before any database or hashing work.
+    """
+    # request.form[] is a type of dictionary mapping. 
+    username = request.form['username']
+    password = request.form['password']
+    
+    check_throttle(username)
+    return username, password
+
+def validate_registration(username, password):
+    """Returns the error to show for a registration form, or None if it is valid"""
+    # Check that they are not empty
+    if not username:
+        return 'Username is required.'
+    if not password:
+        return 'Password is required.'
+    return None
+
+def create_user(username, password_hash):
+    """Inserts a new user, and returns their id. Returns None if the username is already in use"""
+    database = get_database()
+    
+    # Try catch for error handling
+    try:
+        # takes SQL query 
+        # ? are placeholders for user input, tuple is what to replace the placeholders with
+        # The database library will automatically protect from SQL injection 
+        cursor = database.execute( 
+            "INSERT INTO user (username, password) VALUES (?, ?)", (username, password_hash)
+        )
+        database.commit() # Commit changes to the database
+    except database.IntegrityError: # If username is already in use
+        return None
+    
+    # If the database was reset, then this id may still be cached for an old user
+    forget_user(cursor.lastrowid)
+    return cursor.lastrowid
+
+def find_user(username):
+    """Returns the user row for username, including their password hash, or None if there isn't one"""
+    # SELECT [ALL] FROM the user table WHERE the username field = the provided username
+    return get_database().execute(
+        'SELECT * FROM user WHERE username = ?', (username,)
+    ).fetchone()
+
+def update_password(user_id, password_hash):
+    """Replaces the stored password hash of a user"""
+    database = get_database()
+    database.execute('UPDATE user SET password = ? WHERE id = ?', (password_hash, user_id))
+    database.commit()
+
+def log_in(user):
+    """Starts a new session for user, and returns the redirect to the index"""
+    # session is a dictionary that stores data across requests
+    # When validation succeeds the user id is stored in a new session. 
+    # Data is stored in a cookie that is sent to the browser, before being sent back with subsequent request
+    session.clear()
+    session['user_id'] = user['id']
+    
+    # url_for automatially generates a url for based on name
+    # redirect then redirects the user to that url
+    # If the user is logged in, then their information should be loaded and made available to other views
+    return redirect(url_for('index'))
+
+def get_user(user_id):
+    """Returns the id and username of a user, or None if they do not exist.
+    The password hash is not loaded, as no view or template needs it.
+    """
+    cache = current_app.extensions['user_cache']
+    user = cache.get(user_id)
+    
+    if user is None: # If the user was not cached, then retrieve them from the database
+        row = get_database().execute(
+            'SELECT id, username FROM user WHERE id = ?', (user_id,)
         ).fetchone()
         
+        if row is None:
+            return None
+
+        user = dict(row)
+        cache.set(user_id, user)
+
+    return user
+
+def forget_user(user_id):
+    """Removes a user from the cache. 
+    This should be called whenever a user's row in the database changes.
+    """
+    current_app.extensions['user_cache'].delete(user_id)
+        
 #########################################################################################
 ###################################### Decorator ########################################
 #########################################################################################
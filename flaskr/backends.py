@@ -0,0 +1,117 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import sqlite3 # The shared backends store their data in an SQLite file
+import threading
+from collections import OrderedDict # Remembers the order that keys were used in
+
+import click
+from flask import current_app, jsonify
+from flask.cli import with_appcontext
+
+
+#########################################################################################
+#################################### Storage ############################################
+#########################################################################################
+
+"""The pieces shared by the page cache and the login throttle.
+Both keep their data either in the memory of each process, or in an SQLite file shared by every worker,
+and both report counters through a 'flask <name>-stats' command, and optionally a /<name>-stats view.
+"""
+
+class LeastRecentlyUsed(OrderedDict):
+    """A dictionary which holds at most max_entries items.
+    put() marks an item as the most recently used, and removes the least recently used items if it is full.
+    It is not locked, so its owner must hold a lock while using it.
+    """
+
+    def __init__(self, max_entries):
+        super().__init__()
+        self.max_entries = max_entries
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+
+        while len(self) > self.max_entries:
+            self.popitem(last=False)
+
+
+class SQLiteFile:
+    """The base of backends which keep their data in an SQLite file, so that every worker shares it.
+
+    - path is the file used to store the data
+    - schema is the SQL which creates the backend's tables, if they do not exist yet
+    - synchronous is the PRAGMA synchronous setting. 'OFF' is fastest, for data that does not matter if lost in a crash
+    - isolation_level is passed to sqlite3.connect. None lets the backend start its own transactions
+    """
+
+    def __init__(self, path, schema, synchronous='OFF', isolation_level=''):
+        self.path = path
+        self.synchronous = synchronous
+        self.isolation_level = isolation_level
+        self._local = threading.local() # Each thread has its own connection to the file
+
+        with self._connect() as connection:
+            connection.executescript(schema)
+
+    def _connect(self):
+        """Returns this thread's connection to the file, opening it if needed"""
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=self.isolation_level)
+            connection.execute('PRAGMA journal_mode=WAL') # Readers do not wait for writers
+            connection.execute(f'PRAGMA synchronous={self.synchronous}')
+            self._local.connection = connection
+
+        return connection
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def create_backend(app, prefix, memory, sqlite):
+    """Creates the backend named by the <prefix>_BACKEND setting.
+
+    - 'memory' calls memory(), for a backend which keeps its data in this process
+    - 'sqlite' calls sqlite(path), with the file at <prefix>_PATH, for a backend shared by every worker
+    - None turns it off
+    - anything else is used as the backend itself
+    """
+    backend = app.config[f'{prefix}_BACKEND']
+
+    if backend is None:
+        return None
+    if backend == 'memory':
+        return memory()
+    if backend == 'sqlite':
+        return sqlite(app.config[f'{prefix}_PATH'])
+    return backend
+
+def register_stats(app, name, extension, description):
+    """Registers 'flask <name>-stats', which prints the stats() of app.extensions[extension].
+    They are also served as JSON at /<name>-stats if STATS_VIEWS is set, as anyone could visit it.
+    description is what is being counted, such as 'page cache', and is used in the help and messages.
+    """
+    def stats_view():
+        backend = current_app.extensions[extension]
+        return jsonify(backend.stats() if backend is not None else {})
+
+    def stats_command():
+        backend = current_app.extensions[extension]
+
+        if backend is None:
+            click.echo(f'The {description} is turned off.')
+        else:
+            for counter, count in backend.stats().items():
+                click.echo(f'{counter}: {count}')
+
+    if app.config['STATS_VIEWS']:
+        app.add_url_rule(f'/{name}-stats', f'{name.replace("-", "_")}_stats', stats_view)
+
+    app.cli.add_command(click.Command(
+        f'{name}-stats', callback=with_appcontext(stats_command), # As app.cli.command() would do
+        help=f'Prints the counters of the {description}. For the memory backend, these only cover this process.',
+    ))
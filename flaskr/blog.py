@@ -2,13 +2,18 @@
 #################################### Imports ############################################
 #########################################################################################
 
+import datetime
+
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, url_for
+    Blueprint, before_render_template, current_app, flash, g, redirect, render_template, request, session,
+    stream_with_context, template_rendered, url_for
 )
+from markupsafe import Markup, escape
 from werkzeug.exceptions import abort
 
 from flaskr.authentication import login_required
-from flaskr.database import get_database
+from flaskr.cache import get_cache
+from flaskr.database import bump_content_version, get_content_version, get_database, run_write
 
 
 #########################################################################################
@@ -29,20 +34,75 @@ blueprint = Blueprint('blog', __name__)
 
 @blueprint.route('/') # The '/' will lead to this function
 def index():
-    """The Index will display all posts, as outlined above
+    """The Index will display posts, newest first, one page at a time.
+    
+    Pages are found with a cursor rather than an offset. 
+    ?before=<cursor> moves to older posts, and ?after=<cursor> moves back to newer posts.
+    
+    If INDEX_STREAMING is enabled, then the page is sent to the browser while it is still being rendered.
+    Rendered pages are kept in the page cache until a post is created, updated or deleted.
     """
-    database = get_database() # Retrieve a connection to the database
+    # Pages which have already been rendered are sent straight from the cache
+    key, html = get_cached_page()
+    if html is not None:
+        return html
     
-    # From the database, fetch the everythinh from the posts table.
-    # Order them by created in descending order. So new posts show at the top. 
-    posts = database.execute(
-        'SELECT p.id, title, body, created, author_id, username'
-        ' FROM post p JOIN user u ON p.author_id = u.id'
-        ' ORDER BY created DESC'
-    ).fetchall()
+    # The cursors are passed in the query string of the url
+    before = request.args.get('before')
+    after = request.args.get('after')
+    
+    # When streaming, rows are read from the database as the template reaches them
+    streaming = current_app.config['INDEX_STREAMING']
+    
+    # Fetch a single page of posts, which also knows the cursors for the pages either side of it
+    page = get_posts_page(before=before, after=after, lazy=streaming)
     
-    # Returns a command to render the specified template, and passes it the posts as a parameter. 
-    return render_template('blog/index.html', posts=posts)
+    if streaming: # A streamed page is never stored in the cache, as it is never held in full
+        return stream_index(page)
+    
+    # Renders the specified template, and passes it the page of posts as a parameter. 
+    # The page is then stored in the cache under key
+    return render_and_cache(key, 'blog/index.html', page=page)
+
+@blueprint.route('/<int:id>')
+def post(id):
+    """Displays a single post in full. Anyone can view a post, so the author is not checked."""
+    return render_template('blog/post.html', post=get_post(id, check_author=False))
+
+@blueprint.route('/user/<username>')
+def author(username):
+    """Displays one user's posts, newest first, paged with cursors the same way as the index.
+    The number of posts and when they last posted are read from the user row, rather than counted.
+    """
+    user = get_database().execute(
+        'SELECT id, username, post_count, last_posted FROM user WHERE username = ?', (username,)
+    ).fetchone()
+    
+    if user is None:
+        abort(404, f"User {username} doesn't exist.")
+    
+    # Pages which have already been rendered are sent straight from the cache
+    key, html = get_cached_page()
+    if html is not None:
+        return html
+    
+    page = get_posts_page(
+        before=request.args.get('before'), after=request.args.get('after'), author_id=user['id']
+    )
+    return render_and_cache(key, 'blog/author.html', author=user, page=page)
+
+@blueprint.route('/search')
+def search():
+    """Searches the title and body of every post for the words in ?q=
+    Results are ordered by how well they match, best first, and paged with ?before=<cursor>.
+    """
+    query = request.args.get('q', '').strip()
+    before = request.args.get('before')
+    
+    # Without any words to search for, just show the empty search page
+    page = search_posts(query, before=before) if query else None
+    
+    return render_template('blog/search.html', query=query, page=page)
 
 @blueprint.route('/create', methods=('GET', 'POST'))
 @login_required # Calls the login_required() function from authentication. Must be logged in. 
@@ -67,16 +127,22 @@ def create():
             flash(error)
         else:
             
-            # If there was no error, then get a connection to the database
-            database = get_database()
+            author_id = g.user['id']
             
-            # Insert the post into the post table within the database 
-            database.execute(
-                'INSERT INTO post (title, body, author_id)'
-                ' VALUES (?, ?, ?)',
-                (title, body, g.user['id'])
-            )
-            database.commit()
+            # The excerpt shown on the index is worked out once, when the post is written
+            excerpt, word_count = make_excerpt(body)
+            
+            def insert(database):
+                """Insert the post into the post table within the database"""
+                database.execute(
+                    'INSERT INTO post (title, body, excerpt, word_count, author_id)'
+                    ' VALUES (?, ?, ?, ?, ?)',
+                    (title, body, excerpt, word_count, author_id)
+                )
+                bump_content_version('post', database) # Cached copies of the index are now out of date
+            
+            # Runs the insert and commits it, either on this request's connection or the group commit writer
+            run_write(insert)
             
             # Redirect the user back to the index page
             return redirect(url_for('blog.index'))
@@ -112,17 +178,22 @@ def update(id):
             flash(error)
         else:
             
-            # Retrieve a connection to the database
-            database = get_database()
+            # The excerpt shown on the index is worked out once, when the post is written
+            excerpt, word_count = make_excerpt(body)
             
-            # With that connection, update the post in the post table, with the supplied parameters
-            # We update post WHERE it is equal to the supplied id. 
-            database.execute(
-                'UPDATE post SET title = ?, body = ?'
-                ' WHERE id = ?',
-                (title, body, id)
-            )
-            database.commit()
+            def update_post(database):
+                """Update the post in the post table, with the supplied parameters
+                We update post WHERE it is equal to the supplied id. 
+                """
+                database.execute(
+                    'UPDATE post SET title = ?, body = ?, excerpt = ?, word_count = ?'
+                    ' WHERE id = ?',
+                    (title, body, excerpt, word_count, id)
+                )
+                bump_content_version('post', database) # Cached copies of the index are now out of date
+            
+            # Runs the update and commits it, either on this request's connection or the group commit writer
+            run_write(update_post)
             
             # redirect the user back to the index
             return redirect(url_for('blog.index'))
@@ -136,12 +207,13 @@ def delete(id):
     # Retrieves the post by the specified id
     get_post(id) # If the post cannot be found, then the blueprint aborts. 
     
-    # Get a connection to the database
-    database = get_database()
+    def delete_post(database):
+        """From the post table, delete every post where the id equally the supplied id"""
+        database.execute('DELETE FROM post WHERE id = ?', (id,))
+        bump_content_version('post', database) # Cached copies of the index are now out of date
     
-    # From the post table, delete every post where the id equally the supplied id
-    database.execute('DELETE FROM post WHERE id = ?', (id,))
-    database.commit()
+    # Runs the delete and commits it, either on this request's connection or the group commit writer
+    run_write(delete_post)
     
     # When a post has been deleted, redirect to the index
     return redirect(url_for('blog.index'))
@@ -178,4 +250,287 @@ def get_post(id, check_author=True):
     if check_author and post['author_id'] != g.user['id']:
         abort(403, "You are not the owner of this post.")
 
-    return post
\ No newline at end of file
+    return post
+
+def index_cache_key():
+    """Returns the key the current index or author page is cached under, or None if it should not be cached.
+    
+    The key is made from:
+    - the version of the posts, so any change to a post means a new key
+    - who is viewing the page, as logged in users see their own name and edit links
+    - the url, which includes the author and the page cursor
+    """
+    # A page showing flashed messages is only meant to be seen once
+    if '_flashes' in session:
+        return None
+    
+    viewer = 'anonymous' if g.user is None else f"user:{g.user['id']}"
+    return f"index:{get_content_version('post')}:{viewer}:{request.full_path}"
+
+def get_cached_page():
+    """Returns the cache key for the current page, and the page if it is already in the cache.
+    The key is None if the page should not be cached, and the page is None if it was not found.
+    """
+    cache = get_cache()
+    key = index_cache_key() if cache is not None else None
+    
+    if key is None:
+        return None, None
+    
+    return key, cache.get(key)
+
+def render_and_cache(key, template, **context):
+    """Renders template, and stores the result in the page cache under key, unless key is None"""
+    html = render_template(template, **context)
+    
+    if key is not None:
+        get_cache().set(key, html)
+    
+    return html
+
+def make_excerpt(body, words=None):
+    """Returns the excerpt of a post's body, and the number of words in the body.
+    The excerpt is the first EXCERPT_WORDS words, with '...' on the end if the body was cut short.
+    """
+    if words is None:
+        words = current_app.config['EXCERPT_WORDS']
+
+    split = body.split()
+    excerpt = ' '.join(split[:words])
+    
+    if len(split) > words:
+        excerpt += ' ...'
+    
+    return excerpt, len(split)
+
+def encode_cursor(post):
+    """A cursor marks a position in the list of posts. 
+    It is made from the created timestamp and the id of a post, as two posts could share the same timestamp.
+    """
+    return f"{post['created']}_{post['id']}"
+
+def decode_cursor(cursor):
+    """Splits a cursor back into its created timestamp and post id.
+    If the cursor has been tampered with, then abort with an error.
+    """
+    created, _, id = cursor.rpartition('_')
+    
+    try:
+        created = datetime.datetime.fromisoformat(created)
+    except ValueError:
+        abort(400, f"Invalid cursor {cursor}.")
+    
+    if created.tzinfo is not None or not id.isdigit():
+        abort(400, f"Invalid cursor {cursor}.")
+
+    # Timestamps are stored as text like '2024-01-31 12:00:00', and compared as text, 
+    # so the cursor is turned back into exactly that form
+    return str(created), int(id)
+
+class PostsPage:
+    """A single page of posts from the blog index.
+    
+    fetch is a function which runs the query and returns a database cursor over the rows.
+    encode is a function which turns a post into a cursor, by default from its created timestamp and id.
+    The rows are either read all at once, or lazily as the page is iterated over. 
+    The cursors for the pages either side are only known once the rows have been read.
+    """
+    
+    def __init__(self, fetch, per_page, has_previous, lazy=False, encode=None):
+        self.per_page = per_page
+        self.encode = encode or encode_cursor # Turns a post into a cursor
+        self.has_previous = has_previous # If there are newer posts than this page
+        self.has_more = False # If there are older posts than this page. One extra row is fetched to find out
+        self.first = None # The first and last posts on the page
+        self.last = None
+        
+        # posts is what the template loops over 
+        self.posts = self._walk(fetch)
+        if not lazy:
+            self.posts = list(self.posts)
+
+    def _walk(self, fetch):
+        """Yields up to per_page rows, keeping track of the first and last post.
+        The query is only run once the first row is asked for.
+        """
+        for count, row in enumerate(fetch()):
+            if count == self.per_page: # The extra row means there is another page
+                self.has_more = True
+                break
+
+            if self.first is None:
+                self.first = row
+            self.last = row
+            yield row
+
+    @property
+    def next_cursor(self):
+        """The cursor for the page of older posts, or None if there isn't one."""
+        return self.encode(self.last) if self.has_more else None
+
+    @property
+    def previous_cursor(self):
+        """The cursor for the page of newer posts, or None if there isn't one."""
+        return self.encode(self.first) if self.has_previous and self.first is not None else None
+
+def get_posts_page(before=None, after=None, per_page=None, lazy=False, author_id=None):
+    """Fetches a single page of posts, ordered newest first. 
+    
+    - before is a cursor, and returns the page of posts older than it
+    - after is a cursor, and returns the page of posts newer than it
+    - if neither is given, then the first page is returned
+    - lazy does not run the query until the page is iterated over, and then reads the rows one at a time
+    - author_id only includes the posts of that user
+    
+    The query uses the post_created_id index, or post_author_created_id for a single author,
+    so a page costs the same no matter how many posts exist.
+    """
+    if per_page is None:
+        per_page = current_app.config['POSTS_PER_PAGE']
+
+    database = get_database()
+    has_previous = before is not None
+    inclusive = False # If the post at the before cursor is on this page
+    
+    # For an author's feed, every query also matches on author_id, which is the first column of its index
+    author = '' if author_id is None else 'author_id = ? AND '
+    author_parameters = () if author_id is None else (author_id,)
+
+    if after is not None:
+        # Walk towards newer posts to find the newest post on the page. 
+        # Only the indexed columns are read, so this does not touch the post rows.
+        keys = database.execute(
+            'SELECT created, id FROM post'
+            f' WHERE {author}(created, id) > (?, ?)'
+            ' ORDER BY created ASC, id ASC LIMIT ?',
+            (*author_parameters, *decode_cursor(after), per_page + 1)
+        ).fetchall()
+        
+        # If there are more newer posts than fit on a page, then there is a previous page
+        has_previous = len(keys) > per_page
+        
+        if keys:
+            # The page is then read newest first, starting from (and including) that post
+            newest = keys[min(len(keys), per_page) - 1]
+            before = encode_cursor(newest)
+            inclusive = True
+
+    # The cursor is checked now, so that a bad cursor is an error even when the page is streamed
+    if before is not None:
+        before = decode_cursor(before)
+    
+    # Only the excerpt is read, rather than the full body
+    query = (
+        'SELECT p.id, title, excerpt, word_count, created, author_id, username'
+        ' FROM post p JOIN user u ON p.author_id = u.id'
+    )
+    
+    def fetch():
+        """Runs the query for the page. 
+        One extra row is fetched to find out if there is another page after this one
+        """
+        if before is not None:
+            comparison = '<=' if inclusive else '<'
+            return get_database().execute(
+                query + f' WHERE {author}(created, p.id) {comparison} (?, ?)'
+                ' ORDER BY created DESC, p.id DESC LIMIT ?',
+                (*author_parameters, *before, per_page + 1)
+            )
+
+        return get_database().execute(
+            query + (' WHERE author_id = ?' if author_id is not None else '') +
+            ' ORDER BY created DESC, p.id DESC LIMIT ?',
+            (*author_parameters, per_page + 1)
+        )
+
+    return PostsPage(fetch, per_page, has_previous, lazy=lazy)
+
+def search_posts(query, before=None, per_page=None):
+    """Fetches a single page of posts matching query, from the post_search full text index.
+    
+    Posts are ranked by bm25, where lower is a better match, and the id breaks ties.
+    before is a cursor of '<rank>_<id>', and returns the page of posts ranked after it.
+    """
+    if per_page is None:
+        per_page = current_app.config['POSTS_PER_PAGE']
+    
+    # Every word is quoted, so that characters like - or " are searched for instead of being treated as FTS5 syntax
+    match = ' '.join('"' + word.replace('"', '""') + '"' for word in query.split())
+    
+    # highlight and snippet wrap the matching words in markers, which are turned into <mark> tags by mark_matches
+    sql = (
+        "SELECT p.id, created, author_id, username, post_search.rank AS rank,"
+        f" highlight(post_search, 0, '{MATCH_START}', '{MATCH_END}') AS title,"
+        f" snippet(post_search, 1, '{MATCH_START}', '{MATCH_END}', '...', 32) AS snippet"
+        " FROM post_search"
+        " JOIN post p ON p.id = post_search.rowid"
+        " JOIN user u ON p.author_id = u.id"
+        " WHERE post_search MATCH ?"
+    )
+    
+    # The cursor is checked now, rather than when the page is read
+    if before is not None:
+        before = decode_search_cursor(before)
+    
+    def fetch():
+        """Runs the search. One extra row is fetched to find out if there is another page"""
+        if before is not None:
+            return get_database().execute(
+                sql + ' AND (post_search.rank, p.id) > (?, ?) ORDER BY post_search.rank, p.id LIMIT ?',
+                (match, *before, per_page + 1)
+            )
+
+        return get_database().execute(
+            sql + ' ORDER BY post_search.rank, p.id LIMIT ?', (match, per_page + 1)
+        )
+    
+    return PostsPage(fetch, per_page, has_previous=False, encode=lambda post: f"{post['rank']!r}_{post['id']}")
+
+def decode_search_cursor(cursor):
+    """Splits a search cursor back into its rank and post id.
+    If the cursor has been tampered with, then abort with an error.
+    """
+    rank, _, id = cursor.rpartition('_')
+    
+    try:
+        return float(rank), int(id)
+    except ValueError:
+        abort(400, f"Invalid cursor {cursor}.")
+
+# Characters which will never be typed into a post, used to mark where search matches start and end
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+@blueprint.app_template_filter('mark_matches')
+def mark_matches(text):
+    """A template filter which escapes text, and then wraps the search matches in <mark> tags"""
+    return Markup(
+        escape(text).replace(MATCH_START, Markup('<mark>')).replace(MATCH_END, Markup('</mark>'))
+    )
+
+def stream_index(page):
+    """Renders the index template as a stream. 
+    The header from base.html is sent straight away, and posts are sent in chunks as they are read. 
+    INDEX_STREAM_BUFFER is how many template events are grouped into each chunk.
+    """
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_template('blog/index.html')
+    
+    # Adds g, request, session, url_for etc. to the template, the same as render_template does
+    context = {'page': page}
+    app.update_template_context(context)
+    
+    stream = template.stream(context)
+    stream.enable_buffering(app.config['INDEX_STREAM_BUFFER'])
+    
+    # The render signals are sent when the stream starts and once it has finished, the same as
+    # flask.stream_template does, so the render time is measured for streamed pages too
+    before_render_template.send(app, template=template, context=context)
+    
+    def generate():
+        yield from stream
+        template_rendered.send(app, template=template, context=context)
+    
+    # stream_with_context keeps the request alive until the stream is finished.
+    # The page's query runs inside the stream, on a connection which is closed once the stream is done
+    return app.response_class(stream_with_context(generate()), mimetype='text/html')
@@ -0,0 +1,205 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import threading # Locks so that the cache can be used by several threads at once
+import time
+
+from flask import current_app
+
+from flaskr.backends import LeastRecentlyUsed, SQLiteFile, create_backend, register_stats
+
+
+#########################################################################################
+#################################### Backends ###########################################
+#########################################################################################
+
+class MemoryCache:
+    """Stores values, such as rendered pages, in the memory of this process.
+
+    - max_entries is the most values that will be kept. When it is full, the least recently used value is removed
+    - ttl is how many seconds a value is kept for
+    """
+
+    def __init__(self, max_entries=256, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = LeastRecentlyUsed(max_entries) # key -> (expires, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value stored for key, or None if there isn't one"""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None) # Remove it if it has expired
+                self.misses += 1
+                return None
+
+            # Move the key to the end, as it is now the most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Stores a value, removing the least recently used values if the cache is full"""
+        with self._lock:
+            self._entries.put(key, (time.monotonic() + self.ttl, value))
+
+    def delete(self, key):
+        """Removes a single entry from the cache"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the counters for the cache"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+class SQLiteCache(SQLiteFile):
+    """Stores rendered pages in an SQLite file.
+    Every worker that points at the same file shares the same pages and counters.
+
+    - path is the file used to store the pages
+    - max_entries is the most pages that will be kept. When it is full, the least recently used pages are removed
+    - ttl is how many seconds a page is kept for
+    - touch_interval is how old a page's last used time must be before a hit updates it
+    - flush_every is how many lookups are counted in memory before the counters are written to the file
+
+    A hit is usually only a read, so workers serving cached pages do not wait on each other for the write lock.
+    """
+
+    def __init__(self, path, max_entries=256, ttl=60, touch_interval=1.0, flush_every=100):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self.flush_every = flush_every
+        self._pending = {'hits': 0, 'misses': 0} # Counts not yet written to the file
+        self._pending_lock = threading.Lock()
+
+        # synchronous=OFF, as losing the cache in a crash does not matter
+        super().__init__(
+            path,
+            'CREATE TABLE IF NOT EXISTS cache ('
+            '  key TEXT PRIMARY KEY, value TEXT NOT NULL,'
+            '  expires REAL NOT NULL, used REAL NOT NULL'
+            ');'
+            'CREATE INDEX IF NOT EXISTS cache_used ON cache (used);'
+            'CREATE TABLE IF NOT EXISTS cache_stats (name TEXT PRIMARY KEY, count INTEGER NOT NULL);'
+            "INSERT OR IGNORE INTO cache_stats VALUES ('hits', 0), ('misses', 0);",
+            synchronous='OFF',
+        )
+
+    def get(self, key):
+        """Returns the page stored for key, or None if there isn't one.
+        The page's last used time is only updated if it is more than touch_interval seconds old,
+        which is close enough for choosing which pages to remove.
+        """
+        now = time.time()
+        connection = self._connect()
+        row = connection.execute(
+            'SELECT value, used FROM cache WHERE key = ? AND expires >= ?', (key, now)
+        ).fetchone()
+
+        if row is not None and now - row[1] > self.touch_interval:
+            with connection:
+                connection.execute('UPDATE cache SET used = ? WHERE key = ?', (now, key))
+
+        self._count('misses' if row is None else 'hits')
+        return None if row is None else row[0]
+
+    def _count(self, name):
+        """Counts a hit or miss in memory, writing the counts to the file every flush_every lookups"""
+        with self._pending_lock:
+            self._pending[name] += 1
+            if sum(self._pending.values()) < self.flush_every:
+                return
+        self._flush()
+
+    def _flush(self):
+        """Adds the counts kept in memory to the counters in the file"""
+        with self._pending_lock:
+            pending = self._pending
+            self._pending = {'hits': 0, 'misses': 0}
+
+        with self._connect() as connection:
+            connection.executemany(
+                'UPDATE cache_stats SET count = count + ? WHERE name = ?',
+                [(count, name) for name, count in pending.items() if count]
+            )
+
+    def set(self, key, value):
+        """Stores a page, removing expired and least recently used pages"""
+        now = time.time()
+
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                (key, value, now + self.ttl, now)
+            )
+            connection.execute('DELETE FROM cache WHERE expires < ?', (now,))
+            connection.execute(
+                'DELETE FROM cache WHERE key IN ('
+                '  SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?'
+                ')',
+                (self.max_entries,)
+            )
+
+    def delete(self, key):
+        """Removes a single entry from the cache"""
+        with self._connect() as connection:
+            connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM cache')
+
+    def stats(self):
+        """Returns the counters for the cache, which are shared by every worker.
+        Other workers may still have up to flush_every lookups each that they have not written yet.
+        """
+        self._flush()
+        connection = self._connect()
+        counters = dict(connection.execute('SELECT name, count FROM cache_stats'))
+        counters['entries'] = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return counters
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def create_cache(app):
+    """Creates the backend named by PAGE_CACHE_BACKEND.
+
+    - 'memory' stores pages in this process
+    - 'sqlite' stores pages in the file at PAGE_CACHE_PATH, so they can be shared by workers
+    - None turns the cache off
+    - anything else is used as the backend itself, so long as it has get(), set(), delete(), clear() and stats()
+    """
+    max_entries = app.config['PAGE_CACHE_SIZE']
+    ttl = app.config['PAGE_CACHE_TTL']
+
+    return create_backend(
+        app, 'PAGE_CACHE',
+        memory=lambda: MemoryCache(max_entries, ttl),
+        sqlite=lambda path: SQLiteCache(path, max_entries, ttl),
+    )
+
+def get_cache():
+    """Returns the page cache of the current application, or None if caching is turned off"""
+    return current_app.extensions['page_cache']
+
+def init_app(app):
+    """Creates the cache for the application, and registers the stats command.
+    The stats are also served at /cache-stats if STATS_VIEWS is set, as anyone could visit it.
+    """
+    app.extensions['page_cache'] = create_cache(app)
+    register_stats(app, 'cache', 'page_cache', 'page cache')
@@ -0,0 +1,123 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import time
+import zlib # Compresses responses in the gzip format, a chunk at a time
+
+from flask import current_app, request
+
+from flaskr.metrics import record
+
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def compressor(level):
+    """Returns a zlib compressor which writes the gzip format. wbits=31 means gzip with a 32KB window"""
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+def is_compressible(response):
+    """Returns True if response is text which would be gzipped for a browser which accepts it"""
+    return (
+        not response.direct_passthrough # Files sent with send_file, which may already be compressed
+        and 'Content-Encoding' not in response.headers
+        and response.mimetype in current_app.config['COMPRESS_MIMETYPES']
+    )
+
+def should_compress(response):
+    """Returns True if response is compressible, and the browser has said it can accept it gzipped"""
+    return (
+        200 <= response.status_code < 300
+        and response.status_code != 204
+        and request.accept_encodings['gzip'] > 0 # The quality, which is 0 for 'gzip;q=0' and 1 for '*'
+        and request.method != 'HEAD'
+    )
+
+def observe(metrics, endpoint, seconds, size, compressed_size):
+    """Adds the cost and savings of compressing a response to the metrics, if they are enabled"""
+    if metrics is not None:
+        metrics.observe_compression(endpoint, seconds, size, compressed_size)
+
+def compress_response(response):
+    """Gzips text responses.
+
+    Responses which are already in memory are only compressed if they are at least COMPRESS_MIN_SIZE bytes.
+    Streamed responses are always compressed, one chunk at a time, so they are never held in memory in full.
+    COMPRESS_LEVEL is the zlib level, from 1 (fastest) to 9 (smallest).
+    """
+    if not is_compressible(response):
+        return response
+
+    # The body depends on Accept-Encoding whether or not this browser accepts gzip,
+    # so shared caches must not hand a plain copy to a browser which asked for gzip, or the other way round
+    response.vary.add('Accept-Encoding')
+
+    if not should_compress(response):
+        return response
+
+    level = current_app.config['COMPRESS_LEVEL']
+    endpoint = request.endpoint or 'unknown'
+    metrics = current_app.extensions.get('metrics')
+
+    if response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), response.response, level, metrics, endpoint)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+
+        start = time.perf_counter()
+        gzipper = compressor(level)
+        compressed = gzipper.compress(body) + gzipper.flush()
+        seconds = time.perf_counter() - start
+
+        response.set_data(compressed)
+        record('compress', seconds)
+        observe(metrics, endpoint, seconds, len(body), len(compressed))
+
+    response.headers['Content-Encoding'] = 'gzip'
+
+    # The gzipped bytes are not the same as the original bytes, so a strong ETag can no longer be used for them
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+def compress_stream(chunks, original, level, metrics, endpoint):
+    """Yields the gzipped form of each chunk as it arrives.
+    Each chunk is flushed, so the browser can start showing the page before the stream has finished.
+    original is the stream that chunks come from, which is closed once compression is done.
+    """
+    gzipper = compressor(level)
+    seconds = 0.0
+    size = 0
+    compressed_size = 0
+
+    try:
+        for chunk in chunks:
+            start = time.perf_counter()
+            compressed = gzipper.compress(chunk) + gzipper.flush(zlib.Z_SYNC_FLUSH)
+            seconds += time.perf_counter() - start
+            size += len(chunk)
+            compressed_size += len(compressed)
+            if compressed:
+                yield compressed
+
+        compressed = gzipper.flush()
+        compressed_size += len(compressed)
+        yield compressed
+    finally:
+        # Close the original stream, so it can clean up, such as returning its database connection
+        if hasattr(original, 'close'):
+            original.close()
+
+    observe(metrics, endpoint, seconds, size, compressed_size)
+
+def init_app(app):
+    """Compresses text responses, if COMPRESS_ENABLED is set"""
+    if app.config['COMPRESS_ENABLED']:
+        app.after_request(compress_response)
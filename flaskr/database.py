@@ -3,15 +3,144 @@
 #########################################################################################
 
 import sqlite3 # Import support for an SQLite database
+import threading # A lock stops two threads taking the same connection from the pool
+import time # Used to time queries
 
 import click
-from flask import current_app, g
+from flask import current_app, g, jsonify
 
 
+#########################################################################################
+#################################### Tables #############################################
+#########################################################################################
+
+# The tables which can be exported and imported, and the columns moved for each of them.
+# Users are moved with their password hash, so they can still log in afterwards.
+TABLES = {
+    'users': ('user', ('id', 'username', 'password')),
+    'posts': ('post', ('id', 'author_id', 'created', 'title', 'body')),
+}
+
 #########################################################################################
 #################################### functions ############################################
 #########################################################################################
 
+class InstrumentedConnection(sqlite3.Connection):
+    """An SQLite connection which can time its queries.
+    
+    When recorder is set, every execute is timed and passed to recorder.query(sql, seconds).
+    Rows read lazily from a cursor after execute returns are not included in the time.
+    """
+    recorder = None
+
+    def execute(self, sql, parameters=()):
+        if self.recorder is None:
+            return super().execute(sql, parameters)
+
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.recorder.query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        if self.recorder is None:
+            return super().executemany(sql, parameters)
+
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            self.recorder.query(sql, time.perf_counter() - start)
+
+class ConnectionPool:
+    """Keeps database connections open between requests, so they can be reused.
+    
+    - path is the SQLite file to connect to
+    - max_idle is the most unused connections that will be kept open. Extra connections are closed
+    - pragmas is a dictionary of PRAGMA settings, which are run once on each new connection
+    - statement_cache is how many prepared statements each connection keeps
+    
+    A connection is only ever used by one request at a time, but may be used by different threads over its life.
+    """
+    
+    def __init__(self, path, max_idle=8, pragmas=None, statement_cache=128):
+        self.path = path
+        self.max_idle = max_idle
+        self.pragmas = pragmas or {}
+        self.statement_cache = statement_cache
+        self._idle = [] # Connections which are waiting to be used. The most recently used is at the end
+        self._lock = threading.Lock()
+        
+        # Counters which show how well the pool is working
+        self.created = 0 # Connections opened
+        self.reused = 0 # Times an idle connection was handed out
+        self.discarded = 0 # Connections closed because they were broken or the pool was full
+        self.in_use = 0 # Connections currently being used by a request
+
+    def connect(self):
+        """Opens a new connection and applies the pragmas to it"""
+        connection = sqlite3.connect(   # Establishes a connection to the file pointed at by the DATABASE configuration key
+            self.path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=self.statement_cache,
+            check_same_thread=False, # The pool makes sure only one request uses a connection at a time
+            factory=InstrumentedConnection, # Lets requests time their queries
+        )
+        # tells the established connection to return rows that behave like dictionaries
+        # With this, columsn can be accessed by name:
+        connection.row_factory = sqlite3.Row
+        
+        for name, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+
+        return connection
+
+    def acquire(self):
+        """Returns an idle connection, or opens a new one if there are none"""
+        with self._lock:
+            if self._idle:
+                self.in_use += 1
+                self.reused += 1
+                return self._idle.pop()
+
+        # The counters are only changed once the connection has opened, so a failure does not leave them wrong
+        connection = self.connect()
+        with self._lock:
+            self.in_use += 1
+            self.created += 1
+        return connection
+
+    def release(self, connection):
+        """Returns a connection to the pool once a request is finished with it.
+        Anything the request did not commit is rolled back, so it doesn't leak into the next request.
+        """
+        connection.recorder = None # Stop timing queries for the finished request
+        
+        try:
+            connection.rollback()
+        except sqlite3.Error: # The connection is broken, so it cannot be reused
+            keep = False
+        else:
+            keep = True
+
+        with self._lock:
+            self.in_use -= 1
+            if keep and len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+            self.discarded += 1
+
+        connection.close()
+
+    def stats(self):
+        """Returns the counters for the pool"""
+        with self._lock:
+            return {
+                'created': self.created, 'reused': self.reused, 'discarded': self.discarded,
+                'in_use': self.in_use, 'idle': len(self._idle),
+            }
+
 def get_database():
     """g is a special object unique to each request. it is used to store data-
     - that might be accessed by multiple functions during a request. 
@@ -19,15 +148,14 @@ def get_database():
     
     current_app points to the flask application handling the request. 
     This implementation uses an application factory, so there is no application object. 
+    
+    Connections are borrowed from the application's pool, so they stay open between requests.
     """
     if 'db' not in g:  
-        g.db = sqlite3.connect(   # Establishes a connection to the file pointed at by the DATABASE configuration key
-            current_app.config['DATABASE'],   
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        # tells the established connection to return rows that behave like dictionaries
-        # With this, columsn can be accessed by name:
-        g.db.row_factory = sqlite3.Row
+        g.db = current_app.extensions['database_pool'].acquire()
+        
+        # If this request is being measured, then time its queries
+        g.db.recorder = g.get('request_metrics')
 
     # Return the database retrieved by the connection 
     return g.db
@@ -35,32 +163,157 @@ def get_database():
 def close_database(e=None):
     """Checks if a connection has been created.
     Does this by checking if g.db is defined. 
-    If connection exists, then close the connection.
+    If connection exists, then return it to the pool.
     """
     database = g.pop('db', None)
 
     if database is not None:
-        database.close()
+        current_app.extensions['database_pool'].release(database)
+
+def run_write(function):
+    """Runs function, which takes a database connection and makes some changes, and commits them.
+
+    If WRITE_QUEUE is enabled, then the group commit writer runs it as part of a batch,
+    and this waits until that has been committed. Otherwise it runs on the request's own connection.
+    Either way, anything function raises is raised here, and what it returns is returned.
+    If the writer has not finished the write within WRITE_TIMEOUT seconds, then a 503 error is raised.
+    """
+    writer = current_app.extensions.get('writer')
+
+    if writer is None:
+        database = get_database()
+        result = function(database)
+        database.commit()
+        return result
+
+    return writer.run(function, current_app.config['WRITE_TIMEOUT'])
+
+def database_stats():
+    """A view which returns the counters of the connection pool as JSON"""
+    return jsonify(current_app.extensions['database_pool'].stats())
         
+def get_content_version(name):
+    """Returns the current version of some content, such as 'post'.
+    The version is stored in the database, so it is shared by every worker.
+    """
+    return get_content_changes(name)[0]
+
+def get_content_changes(name):
+    """Returns the current version of some content, and the time it last changed as a UTC datetime"""
+    row = get_database().execute(
+        'SELECT version, changed FROM content_version WHERE name = ?', (name,)
+    ).fetchone()
+    
+    return (0, None) if row is None else (row['version'], row['changed'])
+
+def bump_content_version(name, database=None):
+    """Increases the version of some content, and records when it changed. 
+    This should be called before the changes to that content are committed, so they are saved together.
+    database is the connection making the changes, which is the request's connection if it is not given.
+    """
+    (database or get_database()).execute(
+        'UPDATE content_version SET version = version + 1, changed = CURRENT_TIMESTAMP WHERE name = ?', (name,)
+    )
+
+def read_schema():
+    """Returns the SQL in schema.sql, which creates whatever the database is missing"""
+    # Opens a file relative to the flaskr package. 
+    # This means it should work no matter where the project is deployed
+    with current_app.open_resource('schema.sql') as file:
+        return file.read().decode('utf8')
+
 def init_database():
     """Initalises the database which will be used by the application.
+    Any existing tables are removed first, so every row is lost.
     """
     # Call the get_db() function to retrieve a database connection
     # This connection is used to read in the database as a dictionary
     database = get_database()
 
-    # Opens a file relative to the flaskr package. 
-    # This means it should work no matter where the project is deployed
-    with current_app.open_resource('schema.sql') as file:
-        database.executescript(file.read().decode('utf8'))
+    # Remove the tables if they already exist 
+    # Posts are dropped first, as they reference users
+    database.executescript(
+        'DROP TABLE IF EXISTS post;'
+        'DROP TABLE IF EXISTS user;'
+        'DROP TABLE IF EXISTS content_version;'
+        'DROP TABLE IF EXISTS post_search;'
+    )
+    database.executescript(read_schema())
+
+def upgrade_database():
+    """Brings a database made from an older schema.sql up to date, keeping its rows.
+    Returns a list of the columns and tables which were added.
+
+    schema.sql is the only copy of the schema. It is built in an empty database in memory, and any column
+    that it has but the real database does not is added with ALTER TABLE. schema.sql is then run against
+    the real database, which creates any missing tables, indexes and triggers.
+    Anything which is worked out from the posts, such as excerpts and the search index, is then filled in.
+    """
+    database = get_database()
+    schema = read_schema()
+
+    reference = sqlite3.connect(':memory:')
+    reference.executescript(schema)
+    tables = dict(reference.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'"))
+
+    # Virtual tables, such as the search index, keep their data in shadow tables which they create themselves
+    virtual = [name for name, sql in tables.items() if sql.startswith('CREATE VIRTUAL TABLE')]
+    tables = [name for name in tables if not any(name.startswith(f'{table}_') for table in virtual)]
+    existing = {row['name'] for row in database.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    added = [table for table in tables if table not in existing]
+
+    for table in tables:
+        if table not in existing:
+            continue # schema.sql creates the whole table
+
+        columns = {row['name'] for row in database.execute(f'PRAGMA table_info({table})')}
+        for _, name, type, not_null, default, _ in reference.execute(f'PRAGMA table_info({table})'):
+            if name not in columns:
+                definition = f"{type}{' NOT NULL' if not_null else ''}{f' DEFAULT {default}' if default is not None else ''}"
+                database.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+                added.append(f'{table}.{name}')
+
+    reference.close()
+    database.executescript(schema) # executescript commits the new columns first
+
+    # Fill in what the new columns and tables would hold if the posts had been written since they were added
+    if 'post.excerpt' in added:
+        backfill_excerpts()
+    if 'post_search' in added:
+        rebuild_search_index()
+    if 'user.post_count' in added:
+        rebuild_post_counts()
+
+    return added
         
 def init_app(app):
     """close_db and init_db_command need to be registered with the application instance.
     However, this uses a factory function, so there is no available instance.
     Instead, this function takes the application and does the registration.
+    
+    It also creates the connection pool, which is configured by:
+    - DATABASE_POOL_SIZE, the most idle connections kept open
+    - DATABASE_PRAGMAS, the PRAGMA settings for each connection
+    - DATABASE_STATEMENT_CACHE, the number of prepared statements kept by each connection
+    
+    The pool's counters are served at /database-stats only if STATS_VIEWS is set, as anyone could visit it.
     """
+    app.extensions['database_pool'] = ConnectionPool(
+        app.config['DATABASE'],
+        max_idle=app.config['DATABASE_POOL_SIZE'],
+        pragmas=app.config['DATABASE_PRAGMAS'],
+        statement_cache=app.config['DATABASE_STATEMENT_CACHE'],
+    )
+    if app.config['STATS_VIEWS']:
+        app.add_url_rule('/database-stats', 'database_stats', database_stats)   # Shows how the pool is doing
     app.teardown_appcontext(close_database)   # Tells Flask to call that function when cleaning up after returning response
     app.cli.add_command(init_database_command)   # Adds a new command to the command line, which can be called with the 'flask' command
+    app.cli.add_command(upgrade_database_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(rebuild_post_counts_command)
+    app.cli.add_command(backfill_excerpts_command)
+    app.cli.add_command(export_command)
+    app.cli.add_command(import_command)
 
 
 @click.command('init-db')
@@ -69,4 +322,117 @@ def init_database_command():
     If this works, then it displays a success message, as shown below.
     """
     init_database()
-    click.echo('Initialized the database.')
\ No newline at end of file
+    click.echo('Initialized the database.')
+
+@click.command('upgrade-db')
+def upgrade_database_command():
+    """Adds whatever a database made from an older schema.sql is missing, without losing its rows."""
+    added = upgrade_database()
+    click.echo(f"Upgraded the database, adding {', '.join(added)}." if added else 'The database is up to date.')
+
+def backfill_excerpts(batch_size=1000):
+    """Works out the excerpt and word count of every post again, and returns how many posts there were.
+    schema.sql has no trigger for these, as the blog works them out when a post is written.
+    """
+    from flaskr.blog import make_excerpt # Imported here, as the blog imports this module
+
+    database = get_database()
+    last_id = 0
+    count = 0
+
+    # Posts are read in batches by id, so the whole table is never held in memory
+    while True:
+        rows = database.execute(
+            'SELECT id, body FROM post WHERE id > ? ORDER BY id LIMIT ?', (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+
+        database.executemany(
+            'UPDATE post SET excerpt = ?, word_count = ? WHERE id = ?',
+            [(*make_excerpt(row['body']), row['id']) for row in rows]
+        )
+        bump_content_version('post', database) # Cached copies of the index are now out of date
+        database.commit()
+
+        last_id = rows[-1]['id']
+        count += len(rows)
+
+    return count
+
+def rebuild_search_index():
+    """Rebuilds the full text search index from every row in the post table.
+    The triggers in schema.sql normally keep it up to date, so this is only needed for backfills.
+    A database made before search needs upgrade-db first, which also calls this.
+    """
+    database = get_database()
+    database.execute("INSERT INTO post_search (post_search) VALUES ('rebuild')")
+    database.commit()
+
+def rebuild_post_counts():
+    """Works out every user's post_count and last_posted again from the post table.
+    The triggers in schema.sql normally keep them up to date, so this is only needed for backfills.
+    A database made before author feeds needs upgrade-db first, which also calls this.
+    """
+    database = get_database()
+    database.execute(
+        'UPDATE user SET'
+        '  post_count = (SELECT COUNT(*) FROM post WHERE author_id = user.id),'
+        '  last_posted = (SELECT MAX(created) FROM post WHERE author_id = user.id)'
+    )
+    database.commit()
+
+@click.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Defines a command line command called rebuild-search-index, which calls rebuild_search_index()."""
+    rebuild_search_index()
+    click.echo('Rebuilt the search index.')
+
+@click.command('rebuild-post-counts')
+def rebuild_post_counts_command():
+    """Defines a command line command called rebuild-post-counts, which calls rebuild_post_counts()."""
+    rebuild_post_counts()
+    click.echo('Rebuilt the post counts.')
+
+@click.command('backfill-excerpts')
+@click.option('--batch-size', default=1000, show_default=True, help='Posts updated and committed at a time.')
+def backfill_excerpts_command(batch_size):
+    """Works out the excerpt and word count of every existing post, for example after EXCERPT_WORDS changes.
+    A database made before posts had excerpts needs upgrade-db instead, which also does this.
+    """
+    count = backfill_excerpts(batch_size)
+    click.echo(f'Backfilled the excerpts of {count} posts.')
+
+# The export and import commands are only needed from the command line,
+# so flaskr.transfer is imported when they run, rather than every time the app starts
+
+@click.command('export')
+@click.argument('table', type=click.Choice(list(TABLES)))
+@click.argument('file', type=click.File('w'), default='-')
+@click.option('--format', type=click.Choice(['jsonl', 'csv']), help='Defaults to csv for .csv files, otherwise jsonl.')
+def export_command(table, file, format):
+    """Writes every row of TABLE (users or posts) to FILE, or to the terminal if FILE is left out."""
+    from flaskr import transfer
+
+    start = time.perf_counter()
+    count = transfer.export_rows(table, file, transfer.file_format(file, format))
+    elapsed = time.perf_counter() - start
+
+    # The report goes to stderr, so that it doesn't end up in the export when writing to stdout
+    click.echo(f'Exported {count} {table} in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f} rows/s).', err=True)
+
+@click.command('import')
+@click.argument('table', type=click.Choice(list(TABLES)))
+@click.argument('file', type=click.File('r'), default='-')
+@click.option('--format', type=click.Choice(['jsonl', 'csv']), help='Defaults to csv for .csv files, otherwise jsonl.')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows inserted and committed at a time.')
+@click.option('--drop-indexes', is_flag=True, help='Drop indexes and triggers during the load, and rebuild them afterwards.')
+def import_command(table, file, format, batch_size, drop_indexes):
+    """Inserts every row in FILE, or from the terminal if FILE is left out, into TABLE (users or posts)."""
+    from flaskr import transfer
+
+    start = time.perf_counter()
+    count = transfer.import_rows(table, file, transfer.file_format(file, format), batch_size, drop_indexes)
+    elapsed = time.perf_counter() - start
+
+    click.echo(f'Imported {count} {table} in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f} rows/s).')
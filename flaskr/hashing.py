@@ -0,0 +1,167 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import threading # A semaphore limits how many hashes can be waiting at once
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+
+from flaskr.metrics import record
+
+
+#########################################################################################
+#################################### Pool ###############################################
+#########################################################################################
+
+class HashingPool:
+    """Runs password hashing on a fixed number of workers, so that a burst of logins cannot
+    take over every request thread.
+
+    - method is the werkzeug hashing method, such as 'scrypt' or 'pbkdf2:sha256:600000'
+    - workers is the most hashes that run at once
+    - queue_size is how many more hashes may wait for a worker. Past that, requests are turned away with a 503
+    - executor is 'thread' or 'process'
+    """
+
+    def __init__(self, method='scrypt', workers=4, queue_size=16, executor='thread'):
+        self.method = method
+        self._prefix = hash_prefix(method) # The method and parameters at the start of a hash made with method
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+        if executor == 'process':
+            # Imported here, as loading multiprocessing slows down start up for everyone using threads
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hashing')
+
+        self.rejected = 0 # The number of hashes turned away because the queue was full
+
+    def submit(self, function, *args):
+        """Queues function to run on a worker, and returns a future for its result.
+        If every worker is busy and the queue is full, then a 503 error is raised straight away.
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise ServiceUnavailable('The server is busy, please try again.', retry_after=1)
+
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda future: self._slots.release())
+        return future
+
+    def _run(self, function, *args):
+        """Runs function on a worker and waits for the result"""
+        future = self.submit(function, *args)
+        
+        # The time spent waiting for the hash is added to the request's measurements
+        start = time.perf_counter()
+        try:
+            return future.result()
+        finally:
+            record('hash', time.perf_counter() - start)
+
+    def hash(self, password):
+        """Returns a hash of password, made with the configured method"""
+        # Security related functions are imported when first needed, rather than when the app starts
+        from werkzeug.security import generate_password_hash
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        """Returns True if password matches password_hash"""
+        from werkzeug.security import check_password_hash
+        return self._run(check_password_hash, password_hash, password)
+
+    async def _run_async(self, function, *args):
+        """Runs function on a worker, and awaits the result without blocking the event loop"""
+        # asyncio is only imported by async views, so that it does not slow down start up for everyone else
+        import asyncio
+        future = self.submit(function, *args)
+
+        start = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            record('hash', time.perf_counter() - start)
+
+    async def hash_async(self, password):
+        """The same as hash(), for async views"""
+        from werkzeug.security import generate_password_hash
+        return await self._run_async(generate_password_hash, password, self.method)
+
+    async def check_async(self, password_hash, password):
+        """The same as check(), for async views"""
+        from werkzeug.security import check_password_hash
+        return await self._run_async(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Returns True if password_hash was made with a different method or cost to the configured one.
+        A hash looks like 'scrypt:32768:8:1$salt$hash', so the part before the first $ is compared.
+        """
+        return password_hash.split('$', 1)[0] != self._prefix
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def hash_prefix(method):
+    """Returns the part before the first $ of a hash made with method, such as 'scrypt:32768:8:1'.
+    werkzeug fills in the default cost when method leaves it out, so the defaults are filled in here the same way.
+    This does not hash anything, so it never waits on the pool and never turns a login away with a 503.
+    """
+    name, *args = method.split(':')
+
+    if name == 'scrypt':
+        n, r, p = args or (2**15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+
+    if name == 'pbkdf2':
+        from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+
+    # A method this function does not know about, so hash an empty password once to see, without using the pool
+    from werkzeug.security import generate_password_hash
+    return generate_password_hash('', method).split('$', 1)[0]
+
+def hash_password(password):
+    """Hashes password on the hashing pool of the current application"""
+    return current_app.extensions['hashing'].hash(password)
+
+def check_password(password_hash, password):
+    """Checks password against password_hash on the hashing pool of the current application"""
+    return current_app.extensions['hashing'].check(password_hash, password)
+
+async def hash_password_async(password):
+    """Hashes password on the hashing pool of the current application, for async views"""
+    return await current_app.extensions['hashing'].hash_async(password)
+
+async def check_password_async(password_hash, password):
+    """Checks password against password_hash on the hashing pool of the current application, for async views"""
+    return await current_app.extensions['hashing'].check_async(password_hash, password)
+
+def needs_rehash(password_hash):
+    """Returns True if password_hash should be replaced with one made by the configured method"""
+    return current_app.extensions['hashing'].needs_rehash(password_hash)
+
+def init_app(app):
+    """Creates the hashing pool for the application, configured by:
+    - PASSWORD_HASH_METHOD, the werkzeug method and cost used for new hashes
+    - HASHING_WORKERS, the most hashes run at once
+    - HASHING_QUEUE_SIZE, how many more hashes may wait before requests are turned away
+    - HASHING_EXECUTOR, 'thread' or 'process'
+    """
+    app.extensions['hashing'] = HashingPool(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['HASHING_WORKERS'],
+        queue_size=app.config['HASHING_QUEUE_SIZE'],
+        executor=app.config['HASHING_EXECUTOR'],
+    )
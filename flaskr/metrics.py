@@ -0,0 +1,219 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import bisect # Finds which histogram bucket a value belongs in
+import random # Used to choose which requests are measured
+import threading # A lock protects the totals shared by every thread
+import time
+
+from flask import before_render_template, current_app, g, request, template_rendered
+
+
+#########################################################################################
+#################################### Measurements #######################################
+#########################################################################################
+
+# The upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestMetrics:
+    """The measurements for a single request.
+
+    - slowest is how many of the slowest queries to keep
+    - slow_query_threshold logs any query slower than this many seconds, or None to log nothing
+    """
+
+    def __init__(self, slowest=5, slow_query_threshold=None):
+        self.start = time.perf_counter()
+        self.slowest_count = slowest
+        self.slow_query_threshold = slow_query_threshold
+        self.queries = 0
+        self.times = {'db': 0.0, 'render': 0.0, 'hash': 0.0, 'compress': 0.0} # Total seconds spent on each kind of work
+        self.slowest = [] # (seconds, sql) of the slowest queries, slowest first
+
+    def query(self, sql, seconds):
+        """Called by the database connection after each query"""
+        self.queries += 1
+        self.times['db'] += seconds
+
+        if len(self.slowest) < self.slowest_count or seconds > self.slowest[-1][0]:
+            self.slowest.append((seconds, sql))
+            self.slowest.sort(reverse=True)
+            del self.slowest[self.slowest_count:]
+
+        if self.slow_query_threshold is not None and seconds >= self.slow_query_threshold:
+            current_app.logger.warning('Slow query (%.1f ms): %s', seconds * 1000, sql)
+
+    def server_timing(self, streamed=False):
+        """Returns the measurements as a Server-Timing header, with times in milliseconds.
+        The headers of a streamed response are sent before its body is rendered, so for those the header
+        only covers the work done before the stream started, and says so.
+        """
+        total = time.perf_counter() - self.start
+        timings = [
+            f'db;dur={self.times["db"] * 1000:.2f};desc="{self.queries} queries"',
+            f'render;dur={self.times["render"] * 1000:.2f}',
+            f'hash;dur={self.times["hash"] * 1000:.2f}',
+            f'compress;dur={self.times["compress"] * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ]
+        if streamed:
+            timings.append('streamed;desc="The body is not included, see /metrics"')
+        return ', '.join(timings)
+
+
+class Histogram:
+    """Counts how many values fell into each bucket, as a Prometheus histogram"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # The last count is for values above every bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        """Returns the lines of the Prometheus text format for this histogram"""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class Metrics:
+    """The totals for every measured request handled by this process, grouped by endpoint"""
+
+    def __init__(self, slowest=5):
+        self.slowest_count = slowest
+        self.histograms = {} # (name, endpoint) -> Histogram
+        self.queries = {} # endpoint -> total number of queries
+        self.slowest = [] # (seconds, endpoint, sql) of the slowest queries seen, slowest first
+        self.compressed_bytes = {} # endpoint -> [bytes before compression, bytes after compression]
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, measured):
+        """Adds the measurements of a finished request to the totals"""
+        values = {
+            'request': time.perf_counter() - measured.start,
+            'db': measured.times['db'],
+            'render': measured.times['render'],
+            'hash': measured.times['hash'],
+        }
+
+        with self._lock:
+            for name, value in values.items():
+                self.histograms.setdefault((name, endpoint), Histogram()).observe(value)
+            self.queries[endpoint] = self.queries.get(endpoint, 0) + measured.queries
+
+            self.slowest.extend((seconds, endpoint, sql) for seconds, sql in measured.slowest)
+            self.slowest.sort(reverse=True)
+            del self.slowest[self.slowest_count:]
+
+    def observe_compression(self, endpoint, seconds, size, compressed_size):
+        """Adds the time taken to compress a response, and its size before and after, to the totals.
+        Streamed responses are compressed after the request has finished, so this is kept apart from observe().
+        """
+        with self._lock:
+            self.histograms.setdefault(('compress', endpoint), Histogram()).observe(seconds)
+            totals = self.compressed_bytes.setdefault(endpoint, [0, 0])
+            totals[0] += size
+            totals[1] += compressed_size
+
+    def prometheus(self):
+        """Returns every total in the Prometheus text format"""
+        lines = []
+        with self._lock:
+            for name in ('request', 'db', 'render', 'hash', 'compress'):
+                lines.append(f'# TYPE flaskr_{name}_seconds histogram')
+                for (histogram_name, endpoint), histogram in sorted(self.histograms.items()):
+                    if histogram_name == name:
+                        lines.extend(histogram.lines(f'flaskr_{name}_seconds', f'endpoint="{endpoint}"'))
+
+            lines.append('# TYPE flaskr_db_queries_total counter')
+            for endpoint, count in sorted(self.queries.items()):
+                lines.append(f'flaskr_db_queries_total{{endpoint="{endpoint}"}} {count}')
+
+            lines.append('# TYPE flaskr_compress_input_bytes_total counter')
+            lines.append('# TYPE flaskr_compress_output_bytes_total counter')
+            for endpoint, (size, compressed_size) in sorted(self.compressed_bytes.items()):
+                lines.append(f'flaskr_compress_input_bytes_total{{endpoint="{endpoint}"}} {size}')
+                lines.append(f'flaskr_compress_output_bytes_total{{endpoint="{endpoint}"}} {compressed_size}')
+
+            lines.append('# TYPE flaskr_slowest_query_seconds gauge')
+            for seconds, endpoint, sql in self.slowest:
+                sql = ' '.join(sql.split()).replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'flaskr_slowest_query_seconds{{endpoint="{endpoint}",sql="{sql}"}} {seconds}')
+
+        return '\n'.join(lines) + '\n'
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def record(name, seconds):
+    """Adds seconds spent on some work, such as 'hash', to the current request if it is being measured"""
+    measured = g.get('request_metrics')
+    if measured is not None:
+        measured.times[name] += seconds
+
+def start_request():
+    """Decides if this request will be measured, and if so starts measuring it.
+    METRICS_SAMPLE_RATE is the fraction of requests that are measured.
+    """
+    if random.random() < current_app.config['METRICS_SAMPLE_RATE']:
+        g.request_metrics = RequestMetrics(
+            current_app.config['METRICS_SLOWEST'], current_app.config['SLOW_QUERY_THRESHOLD']
+        )
+
+def finish_request(response):
+    """Adds the Server-Timing header to a measured response, and its measurements to the totals.
+    A streamed response is added to the totals once the stream is closed, so that they include
+    the queries and rendering done while the body was being sent.
+    """
+    measured = g.get('request_metrics')
+    if measured is None:
+        return response
+
+    response.headers['Server-Timing'] = measured.server_timing(streamed=response.is_streamed)
+
+    metrics = current_app.extensions['metrics']
+    endpoint = request.endpoint or 'unknown'
+    if response.is_streamed:
+        response.call_on_close(lambda: metrics.observe(endpoint, measured))
+    else:
+        metrics.observe(endpoint, measured)
+    return response
+
+def start_render(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+def finish_render(sender, template, context, **extra):
+    start = g.pop('render_start', None)
+    if start is not None:
+        record('render', time.perf_counter() - start)
+
+def metrics_view():
+    """A view which returns the totals in the Prometheus text format"""
+    return current_app.extensions['metrics'].prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+def init_app(app):
+    """Starts measuring requests for the application, if METRICS_ENABLED is set.
+    The totals are served at /metrics.
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    app.extensions['metrics'] = Metrics(app.config['METRICS_SLOWEST'])
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(finish_render, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -1,14 +1,17 @@
--- Remove the tables if they already exist 
-DROP TABLE IF EXISTS user;
-DROP TABLE IF EXISTS post;
+-- Every statement only creates what is missing, so this file can be run again on an existing database.
+-- init-db drops the tables before running it, to start from nothing.
+-- upgrade-db adds any missing columns, then runs it to add any missing tables, indexes and triggers.
 
 -- Create a table to store users
 -- A user is defined by a primary key, which is the ID. This id increments with every new user
 -- Users also store a username, which is text. And a password, which is also text. 
-CREATE TABLE user (
+-- post_count and last_posted are kept up to date by the triggers below, so they never need a COUNT(*)
+CREATE TABLE IF NOT EXISTS user (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   username TEXT UNIQUE NOT NULL,
-  password TEXT NOT NULL
+  password TEXT NOT NULL,
+  post_count INTEGER NOT NULL DEFAULT 0,
+  last_posted TIMESTAMP
 );
 
 -- Create a table to store posts
@@ -17,12 +20,67 @@ CREATE TABLE user (
 -- created, which is a timestamp marking when the post was made
 -- title, which stores the title of the post
 -- body, which stores the content of the post
+-- excerpt, which stores the start of the body. The index shows this, so it never has to read the full body
+-- word_count, which stores the number of words in the body
 -- The foreign key used here links a post to a given user in the user table
-CREATE TABLE post (
+CREATE TABLE IF NOT EXISTS post (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   author_id INTEGER NOT NULL,
   created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   title TEXT NOT NULL,
   body TEXT NOT NULL,
+  excerpt TEXT NOT NULL DEFAULT '',
+  word_count INTEGER NOT NULL DEFAULT 0,
   FOREIGN KEY (author_id) REFERENCES user (id)
-);
\ No newline at end of file
+);
+
+-- The blog index pages through posts newest first, using (created, id) as a cursor.
+-- This index lets SQLite walk straight to the cursor position instead of scanning and sorting every post
+CREATE INDEX IF NOT EXISTS post_created_id ON post (created DESC, id DESC);
+
+-- Each author's feed pages through their posts the same way, so this index starts with the author.
+-- It covers finding the cursor positions, and counting and dating an author's posts, without reading the post rows
+CREATE INDEX IF NOT EXISTS post_author_created_id ON post (author_id, created DESC, id DESC);
+
+-- These triggers keep each user's post_count and last_posted in step with the post table
+CREATE TRIGGER IF NOT EXISTS user_post_count_insert AFTER INSERT ON post BEGIN
+  UPDATE user SET post_count = post_count + 1, last_posted = MAX(COALESCE(last_posted, new.created), new.created)
+  WHERE id = new.author_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_post_count_delete AFTER DELETE ON post BEGIN
+  UPDATE user SET post_count = post_count - 1,
+    last_posted = (SELECT MAX(created) FROM post WHERE author_id = old.author_id)
+  WHERE id = old.author_id;
+END;
+
+-- Stores a version number for each kind of content, which is increased every time that content changes.
+-- Cached pages are stored against the version, so a change means old copies are no longer used. 
+-- changed is when the content last changed, and is sent to API clients as Last-Modified
+CREATE TABLE IF NOT EXISTS content_version (
+  name TEXT PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 0,
+  changed TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT OR IGNORE INTO content_version (name) VALUES ('post');
+
+-- A full text search index over the title and body of every post.
+-- It does not store its own copy of the text, and reads it from the post table instead (content='post')
+CREATE VIRTUAL TABLE IF NOT EXISTS post_search USING fts5(
+  title, body, content='post', content_rowid='id'
+);
+
+-- These triggers keep the search index in step with the post table
+CREATE TRIGGER IF NOT EXISTS post_search_insert AFTER INSERT ON post BEGIN
+  INSERT INTO post_search (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_search_delete AFTER DELETE ON post BEGIN
+  INSERT INTO post_search (post_search, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_search_update AFTER UPDATE OF title, body ON post BEGIN
+  INSERT INTO post_search (post_search, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+  INSERT INTO post_search (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
@@ -0,0 +1,47 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import os
+
+import click
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache # Stores compiled templates on disk, so they survive a restart
+
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def init_app(app):
+    """Sets up the application to start quickly.
+
+    If JINJA_BYTECODE_CACHE is a folder, then compiled templates are saved there, and later workers load
+    them instead of compiling the templates again. It is set to a folder in the instance folder by default.
+    This has to happen before the Jinja environment is first used, as the environment is created from jinja_options.
+    """
+    folder = app.config['JINJA_BYTECODE_CACHE']
+
+    if folder is not None:
+        os.makedirs(folder, exist_ok=True)
+        app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(folder)}
+
+    app.cli.add_command(warmup_command)
+
+def warmup(app):
+    """Compiles every template, which saves them in the bytecode cache. Returns the names of the templates"""
+    names = app.jinja_env.list_templates()
+
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    return names
+
+
+@click.command('warmup')
+def warmup_command():
+    """Defines a command line command called warmup, which compiles every template ahead of the first request.
+    Run it after each deploy, so the first request to each template does not have to compile it.
+    """
+    names = warmup(current_app)
+    click.echo(f'Compiled {len(names)} templates.')
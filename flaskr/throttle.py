@@ -0,0 +1,210 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import math
+import threading # Locks so that the buckets can be used by several threads at once
+import time
+
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+from flaskr.backends import LeastRecentlyUsed, SQLiteFile, create_backend, register_stats
+
+
+#########################################################################################
+#################################### Backends ###########################################
+#########################################################################################
+
+"""Login and register attempts are limited with token buckets.
+
+Each bucket holds up to `attempts` tokens, and refills at a rate of `attempts` every `seconds`.
+An attempt takes one token from every bucket it belongs to, one for the client's IP address and
+one for the username. If any of them is empty, nothing is taken and the attempt is turned away.
+
+Both backends provide take(buckets) and stats(), where buckets maps a name, such as 'ip',
+to (key, attempts, seconds), and take() returns how many seconds to wait, or 0 if the attempt is allowed.
+"""
+
+def refill(tokens, updated, now, attempts, seconds):
+    """Returns how many tokens a bucket holds now, given how many it held when it was last updated"""
+    return min(attempts, tokens + (now - updated) * attempts / seconds)
+
+def wait_for(tokens, attempts, seconds):
+    """Returns how many seconds until a bucket holding tokens will have a whole token"""
+    return (1 - tokens) * seconds / attempts
+
+
+class MemoryBuckets:
+    """Stores the buckets in the memory of this process.
+
+    - max_keys is the most buckets that will be kept. When it is full, the least recently used bucket is removed,
+      which is the same as letting it refill
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.rejected = {} # bucket name -> number of attempts it turned away
+        self._buckets = LeastRecentlyUsed(max_keys) # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, buckets):
+        """Takes a token from every bucket, or from none of them if any are empty"""
+        now = time.monotonic()
+
+        with self._lock:
+            levels = {}
+            wait = 0
+            for name, (key, attempts, seconds) in buckets.items():
+                tokens, updated = self._buckets.get(key, (attempts, now))
+                levels[key] = tokens = refill(tokens, updated, now, attempts, seconds)
+
+                if tokens < 1:
+                    self.rejected[name] = self.rejected.get(name, 0) + 1
+                    wait = max(wait, wait_for(tokens, attempts, seconds))
+
+            if wait:
+                return wait
+
+            for key, tokens in levels.items():
+                self._buckets.put(key, (tokens - 1, now))
+
+            self.allowed += 1
+            return 0
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self):
+        """Returns the counters for the buckets"""
+        with self._lock:
+            counters = {'allowed': self.allowed, 'buckets': len(self._buckets)}
+            counters.update((f'rejected_{name}', count) for name, count in self.rejected.items())
+            return counters
+
+
+class SQLiteBuckets(SQLiteFile):
+    """Stores the buckets in an SQLite file.
+    Every worker that points at the same file shares the same buckets and counters,
+    so an attacker cannot get more attempts by having them spread over several workers.
+
+    - path is the file used to store the buckets
+    """
+
+    def __init__(self, path):
+        # isolation_level=None lets take() start its own transaction with BEGIN IMMEDIATE
+        super().__init__(
+            path,
+            'CREATE TABLE IF NOT EXISTS throttle ('
+            '  key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL'
+            ');'
+            'CREATE INDEX IF NOT EXISTS throttle_updated ON throttle (updated);'
+            'CREATE TABLE IF NOT EXISTS throttle_stats (name TEXT PRIMARY KEY, count INTEGER NOT NULL);'
+            "INSERT OR IGNORE INTO throttle_stats VALUES ('allowed', 0);",
+            synchronous='NORMAL',
+            isolation_level=None,
+        )
+
+    def _count(self, connection, name):
+        connection.execute(
+            'INSERT INTO throttle_stats VALUES (?, 1) ON CONFLICT (name) DO UPDATE SET count = count + 1', (name,)
+        )
+
+    def take(self, buckets):
+        """Takes a token from every bucket, or from none of them if any are empty.
+        The buckets are read and written in one transaction, so two workers cannot both take the last token.
+        """
+        now = time.time()
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE') # Lock the file for writing before reading, not after
+
+        try:
+            levels = {}
+            wait = 0
+            for name, (key, attempts, seconds) in buckets.items():
+                row = connection.execute('SELECT tokens, updated FROM throttle WHERE key = ?', (key,)).fetchone()
+                tokens, updated = row if row is not None else (attempts, now)
+                levels[key] = tokens = refill(tokens, updated, now, attempts, seconds)
+
+                if tokens < 1:
+                    self._count(connection, f'rejected_{name}')
+                    wait = max(wait, wait_for(tokens, attempts, seconds))
+
+            if not wait:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO throttle VALUES (?, ?, ?)',
+                    [(key, tokens - 1, now) for key, tokens in levels.items()]
+                )
+                self._count(connection, 'allowed')
+
+                # A bucket which has not been used for longer than it takes to refill is full, so it can be removed
+                longest = max(seconds for key, attempts, seconds in buckets.values())
+                connection.execute('DELETE FROM throttle WHERE updated < ?', (now - longest,))
+
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+        return wait
+
+    def clear(self):
+        self._connect().execute('DELETE FROM throttle')
+
+    def stats(self):
+        """Returns the counters for the buckets, which are shared by every worker"""
+        connection = self._connect()
+        counters = dict(connection.execute('SELECT name, count FROM throttle_stats'))
+        counters['buckets'] = connection.execute('SELECT COUNT(*) FROM throttle').fetchone()[0]
+        return counters
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def create_throttle(app):
+    """Creates the backend named by LOGIN_THROTTLE_BACKEND.
+
+    - 'memory' keeps the buckets in this process, so each worker has its own
+    - 'sqlite' keeps the buckets in the file at LOGIN_THROTTLE_PATH, so they are shared by workers
+    - None turns throttling off
+    - anything else is used as the backend itself, so long as it has take() and stats()
+    """
+    return create_backend(
+        app, 'LOGIN_THROTTLE',
+        memory=lambda: MemoryBuckets(app.config['LOGIN_THROTTLE_SIZE']),
+        sqlite=SQLiteBuckets,
+    )
+
+def get_throttle():
+    """Returns the login throttle of the current application, or None if throttling is turned off"""
+    return current_app.extensions['login_throttle']
+
+def check_throttle(username):
+    """Takes a token from the buckets of the client's IP address and of username.
+    If either is empty, a 429 error is raised with a Retry-After header, before any database or hashing work is done.
+
+    The limits are (attempts, seconds) pairs, set by LOGIN_THROTTLE_IP and LOGIN_THROTTLE_USERNAME.
+    Behind a proxy, request.remote_addr is the proxy's address unless the app is wrapped in werkzeug's ProxyFix.
+    """
+    throttle = get_throttle()
+    if throttle is None:
+        return
+
+    buckets = {
+        'ip': (f'ip:{request.remote_addr}', *current_app.config['LOGIN_THROTTLE_IP']),
+        'username': (f'username:{username}', *current_app.config['LOGIN_THROTTLE_USERNAME']),
+    }
+
+    wait = throttle.take(buckets)
+    if wait:
+        raise TooManyRequests('Too many attempts, please try again later.', retry_after=math.ceil(wait))
+
+def init_app(app):
+    """Creates the login throttle for the application, and registers the stats command.
+    The stats are also served at /throttle-stats if STATS_VIEWS is set, as anyone could visit it.
+    """
+    app.extensions['login_throttle'] = create_throttle(app)
+    register_stats(app, 'throttle', 'login_throttle', 'login throttle')
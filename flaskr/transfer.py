@@ -0,0 +1,111 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import itertools # Used to split rows into batches
+import json # Or as JSON lines, one object per line
+
+from flaskr.blog import make_excerpt
+from flaskr.database import TABLES, bump_content_version, get_database, rebuild_post_counts, rebuild_search_index
+
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def file_format(file, format):
+    """Returns the format to use for a file.
+    If no format was given, then it is 'csv' for files ending in .csv, and 'jsonl' for everything else.
+    """
+    if format is not None:
+        return format
+    return 'csv' if file.name.endswith('.csv') else 'jsonl'
+
+def export_rows(table, file, format):
+    """Writes every row of table to file, one at a time, and returns how many were written.
+    The rows are read straight from the database cursor, so memory use stays the same however big the table is.
+    """
+    name, columns = TABLES[table]
+    rows = get_database().execute(f"SELECT {', '.join(columns)} FROM {name} ORDER BY id")
+
+    if format == 'csv':
+        import csv # Only the command line needs csv, so it is not imported when the app starts
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        write = writer.writerow
+    else:
+        write = lambda row: file.write(json.dumps(dict(zip(columns, row)), default=str) + '\n')
+
+    count = 0
+    for row in rows:
+        write(row)
+        count += 1
+
+    return count
+
+def read_rows(file, format, columns):
+    """Yields each row of file as a tuple of the given columns"""
+    if format == 'csv':
+        import csv
+        records = csv.DictReader(file)
+    else:
+        records = (json.loads(line) for line in file if line.strip())
+
+    for record in records:
+        yield tuple(record[column] for column in columns)
+
+def import_rows(table, file, format, batch_size=10000, drop_indexes=False):
+    """Inserts every row in file into table, and returns how many were inserted.
+
+    Rows are inserted batch_size at a time with executemany, and each batch is committed as a single transaction.
+    If drop_indexes is True, then the indexes and triggers on the table are dropped during the load,
+    and recreated afterwards. This is much faster for large loads, as they are built once at the end.
+    """
+    name, columns = TABLES[table]
+    database = get_database()
+    rows = read_rows(file, format, columns)
+
+    # Posts also need their excerpt, which is worked out from the body
+    if name == 'post':
+        rows = ((*row, *make_excerpt(row[-1])) for row in rows)
+        columns = columns + ('excerpt', 'word_count')
+
+    insert = f"INSERT INTO {name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    # Save the SQL of the indexes and triggers, so they can be recreated once the rows are loaded
+    saved = []
+    if drop_indexes:
+        saved = database.execute(
+            "SELECT type, name, sql FROM sqlite_master"
+            " WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+            (name,)
+        ).fetchall()
+        for item in saved:
+            database.execute(f"DROP {item['type'].upper()} {item['name']}")
+        database.commit()
+
+    count = 0
+    try:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+
+            database.executemany(insert, batch)
+            if name == 'post':
+                bump_content_version('post') # Cached copies of the index are now out of date
+            database.commit()
+            count += len(batch)
+    finally:
+        # Whatever happened, put the indexes and triggers back
+        database.rollback()
+        for item in saved:
+            database.execute(item['sql'])
+        database.commit()
+
+        # The triggers were not running during the load, so the search index and post counts need to catch up
+        if any(item['type'] == 'trigger' for item in saved) and name == 'post':
+            rebuild_search_index()
+            rebuild_post_counts()
+
+    return count
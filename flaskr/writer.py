@@ -0,0 +1,146 @@
+#########################################################################################
+#################################### Imports ############################################
+#########################################################################################
+
+import queue # Requests hand their writes to the writer thread through a queue
+import threading
+import time
+from concurrent.futures import Future # Each request waits on a future for its own write
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from werkzeug.exceptions import ServiceUnavailable
+
+
+#########################################################################################
+#################################### Writer #############################################
+#########################################################################################
+
+class GroupCommitWriter:
+    """A single thread which makes every write to the database, committing many writes at once.
+
+    Requests pass it a function which takes a connection and makes their changes.
+    The writer collects up to max_batch functions, waiting at most max_wait seconds for more to arrive,
+    and runs them all in one transaction. Each function runs inside its own savepoint,
+    so if one fails only its changes are undone, and the error is passed back to its request alone.
+    A request is only told its write succeeded once the transaction holding it has been committed.
+    """
+
+    def __init__(self, connect, max_batch=64, max_wait=0.002):
+        self.connect = connect # A function which opens a new connection to the database
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Counters which show how well writes are being grouped
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, function):
+        """Queues function to be run by the writer, and returns a future for its result"""
+        # The thread is started on first use, so that it is created in the worker process rather than before a fork
+        # If the thread has stopped for any reason, then a new one is started
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+                self._thread.start()
+
+        future = Future()
+        self._queue.put((function, future))
+        return future
+
+    def run(self, function, timeout):
+        """Queues function, and waits until the batch holding it has been committed.
+        If that has not happened within timeout seconds, then a 503 error is raised.
+        The write may still be committed later, as it cannot be taken back out of the queue.
+        """
+        future = self.submit(function)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise ServiceUnavailable('The server is busy, please try again.', retry_after=1)
+
+    def _collect(self):
+        """Waits for a write, and then gathers any more that arrive within max_wait, up to max_batch"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _fail(self, batch, error):
+        """Passes error back to every request in batch which is still waiting"""
+        for function, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _run(self):
+        """The writer thread. Runs forever, committing one batch of writes at a time"""
+        connection = None
+
+        while True:
+            batch = self._collect()
+            results = []
+
+            # The connection is opened here rather than before the loop, so that if it cannot be opened,
+            # the waiting requests are told, and it is tried again for the next batch instead of the thread dying
+            if connection is None:
+                try:
+                    connection = self.connect()
+                except Exception as error:
+                    self._fail(batch, error)
+                    continue
+
+            try:
+                connection.execute('BEGIN IMMEDIATE')
+                for function, future in batch:
+                    connection.execute('SAVEPOINT write')
+                    try:
+                        result = function(connection)
+                    except Exception as error: # Only undo this request's changes
+                        connection.execute('ROLLBACK TO write')
+                        connection.execute('RELEASE write')
+                        future.set_exception(error)
+                    else:
+                        connection.execute('RELEASE write')
+                        results.append((future, result))
+                connection.commit()
+            except Exception as error: # The whole transaction failed, so every write in it failed
+                try:
+                    connection.rollback()
+                except Exception: # The connection is broken, so a new one is opened for the next batch
+                    connection = None
+                self._fail(batch, error)
+                continue
+
+            self.batches += 1
+            self.writes += len(batch)
+            for future, result in results:
+                future.set_result(result)
+
+#########################################################################################
+#################################### functions ##########################################
+#########################################################################################
+
+def init_app(app):
+    """Creates the group commit writer for the application if WRITE_QUEUE is enabled.
+    run_write() in flaskr.database sends writes to it. It is configured by:
+    - WRITE_BATCH_SIZE, the most writes committed together
+    - WRITE_MAX_WAIT, how many seconds the writer waits for more writes before committing
+    - WRITE_TIMEOUT, how many seconds a request waits for its write before giving up with a 503
+    """
+    if not app.config['WRITE_QUEUE']:
+        return
+
+    app.extensions['writer'] = GroupCommitWriter(
+        app.extensions['database_pool'].connect,
+        max_batch=app.config['WRITE_BATCH_SIZE'],
+        max_wait=app.config['WRITE_MAX_WAIT'],
+    )
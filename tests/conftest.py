@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+import pytest
+
+from flaskr import create_app
+from flaskr.database import init_database
+
+
+@pytest.fixture
+def app():
+    """An app with a fresh database in a temporary file, which is removed once the test is done"""
+    database_fd, database_path = tempfile.mkstemp()
+
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': database_path,
+        'JINJA_BYTECODE_CACHE': None, # Don't save compiled templates from the tests
+    })
+
+    with app.app_context():
+        init_database()
+
+    yield app
+
+    os.close(database_fd)
+    os.unlink(database_path)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def runner(app):
+    return app.test_cli_runner()
@@ -0,0 +1,72 @@
+import pytest
+
+from flaskr.blog import decode_cursor, encode_cursor
+from flaskr.database import get_database
+
+
+@pytest.fixture
+def posts(app):
+    """Adds 7 posts, where several share the same created timestamp, and returns their ids newest first"""
+    app.config['POSTS_PER_PAGE'] = 3
+
+    with app.app_context():
+        database = get_database()
+        database.execute("INSERT INTO user (username, password) VALUES ('test', 'x')")
+        created = ['2024-01-01 00:00:00'] * 3 + ['2024-01-02 00:00:00'] * 2 + ['2024-01-03 00:00:00'] * 2
+        for number, timestamp in enumerate(created):
+            database.execute(
+                'INSERT INTO post (author_id, created, title, body) VALUES (1, ?, ?, ?)',
+                (timestamp, f'post {number}', 'body')
+            )
+        database.commit()
+
+    # Newest first, with the highest id first when the timestamps are the same
+    return [7, 6, 5, 4, 3, 2, 1]
+
+
+def page_ids(client, **args):
+    data = client.get('/api/posts', query_string=args).get_json()
+    return [post['id'] for post in data['posts']], data['next'], data['previous']
+
+
+def test_cursor_round_trip(app):
+    post = {'created': '2024-01-31 12:00:00', 'id': 42}
+    assert decode_cursor(encode_cursor(post)) == ('2024-01-31 12:00:00', 42)
+
+    # The stored form always uses a space, whatever separator the cursor used
+    assert decode_cursor('2024-01-31T12:00:00_42') == ('2024-01-31 12:00:00', 42)
+
+
+def test_pages_cover_every_post_once(client, posts):
+    seen = []
+    ids, next, previous = page_ids(client)
+    assert previous is None
+
+    while True:
+        seen.extend(ids)
+        if next is None:
+            break
+        ids, next, previous = page_ids(client, before=next)
+        assert previous is not None
+
+    assert seen == posts
+
+
+def test_after_goes_back_to_the_previous_page(client, posts):
+    first, next, _ = page_ids(client)
+    second, _, previous = page_ids(client, before=next)
+
+    assert second == posts[3:6]
+    assert page_ids(client, after=previous)[0] == first
+
+
+@pytest.mark.parametrize('cursor', [
+    'abc_1', # Not a timestamp
+    '2024-01-01 00:00:00_x', # Not an id
+    '2024-01-01 00:00:00', # No id at all
+    '2024-13-01 00:00:00_1', # Not a real date
+    '2024-01-01 00:00:00+01:00_1', # Timestamps are stored without a timezone
+])
+def test_invalid_cursor(client, posts, cursor):
+    assert client.get('/', query_string={'before': cursor}).status_code == 400
+    assert client.get('/api/posts', query_string={'after': cursor}).status_code == 400
@@ -0,0 +1,104 @@
+import types
+
+import pytest
+
+from flaskr import throttle
+from flaskr.throttle import MemoryBuckets, SQLiteBuckets
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the throttle's clock with one which only moves when the test moves it"""
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(throttle, 'time', types.SimpleNamespace(
+        monotonic=lambda: clock.now, time=lambda: clock.now
+    ))
+    return clock
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def buckets(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBuckets()
+    return SQLiteBuckets(str(tmp_path / 'throttle.sqlite'))
+
+
+def attempt(buckets, ip='1.2.3.4', username='test'):
+    """Makes an attempt against a 3 a minute IP bucket and a 2 a minute username bucket"""
+    return buckets.take({'ip': (f'ip:{ip}', 3, 60), 'username': (f'username:{username}', 2, 60)})
+
+
+def test_empty_bucket_turns_attempts_away(buckets, clock):
+    assert attempt(buckets) == 0
+    assert attempt(buckets) == 0
+
+    # The username bucket is empty, and refills a token every 30 seconds
+    assert attempt(buckets) == pytest.approx(30)
+
+    stats = buckets.stats()
+    assert stats['allowed'] == 2
+    assert stats['rejected_username'] == 1
+
+
+def test_nothing_is_taken_when_turned_away(buckets, clock):
+    attempt(buckets)
+    attempt(buckets)
+    assert attempt(buckets) > 0
+
+    # The rejected attempt did not take the IP bucket's last token, so another username can still use it
+    assert attempt(buckets, username='other') == 0
+    assert attempt(buckets, username='other') > 0
+
+
+def test_buckets_refill(buckets, clock):
+    attempt(buckets)
+    attempt(buckets)
+    assert attempt(buckets) > 0
+
+    clock.now += 15
+    assert attempt(buckets) == pytest.approx(15)
+
+    clock.now += 15
+    assert attempt(buckets) == 0
+
+
+def test_memory_buckets_forget_the_least_recently_used(clock):
+    buckets = MemoryBuckets(max_keys=2)
+
+    attempt(buckets)
+    attempt(buckets)
+    assert attempt(buckets) > 0
+
+    # Two other clients push out the first client's buckets, which is the same as letting them refill
+    attempt(buckets, ip='5.6.7.8', username='other')
+    assert buckets.stats()['buckets'] == 2
+    assert attempt(buckets) == 0
+
+
+def test_sqlite_buckets_are_shared(tmp_path, clock):
+    path = str(tmp_path / 'throttle.sqlite')
+    first, second = SQLiteBuckets(path), SQLiteBuckets(path)
+
+    assert attempt(first) == 0
+    assert attempt(second) == 0
+    assert attempt(first) > 0
+    assert second.stats()['allowed'] == 2
+
+
+def test_login_is_throttled(app, client):
+    app.config['LOGIN_THROTTLE_USERNAME'] = (2, 60)
+
+    for _ in range(2):
+        response = client.post('/auth/login', data={'username': 'a', 'password': 'b'})
+        assert response.status_code == 200
+
+    response = client.post('/auth/login', data={'username': 'a', 'password': 'b'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '30'
+
+
+def test_stats_view_is_off_by_default(client, runner):
+    assert client.get('/throttle-stats').status_code == 404
+
+    result = runner.invoke(args=['throttle-stats'])
+    assert 'allowed: 0' in result.output
@@ -0,0 +1,97 @@
+import sqlite3
+
+import pytest
+
+from flaskr.database import run_write
+from flaskr.writer import GroupCommitWriter
+
+
+@pytest.fixture
+def path(tmp_path):
+    """A database file with a single table for the writer to insert into"""
+    path = tmp_path / 'writer.sqlite'
+    with sqlite3.connect(path) as connection:
+        connection.execute('CREATE TABLE item (name TEXT UNIQUE NOT NULL)')
+    return path
+
+
+def names(path):
+    with sqlite3.connect(path) as connection:
+        return sorted(row[0] for row in connection.execute('SELECT name FROM item'))
+
+
+def insert(name):
+    """Returns a write which inserts name, and returns it"""
+    def write(connection):
+        connection.execute('INSERT INTO item (name) VALUES (?)', (name,))
+        return name
+    return write
+
+
+def insert_then_fail(connection):
+    """A write which changes the table before failing, so its change must be undone"""
+    connection.execute("INSERT INTO item (name) VALUES ('undone')")
+    raise ValueError('failed')
+
+
+def test_failing_write_only_rolls_back_its_savepoint(path):
+    # A long max_wait makes sure all three writes end up in the same batch
+    writer = GroupCommitWriter(lambda: sqlite3.connect(path), max_batch=3, max_wait=5)
+
+    first = writer.submit(insert('first'))
+    failing = writer.submit(insert_then_fail)
+    last = writer.submit(insert('last'))
+
+    assert first.result(timeout=5) == 'first'
+    assert last.result(timeout=5) == 'last'
+    with pytest.raises(ValueError):
+        failing.result(timeout=5)
+
+    assert writer.batches == 1
+    assert names(path) == ['first', 'last']
+
+
+def test_constraint_error_goes_to_its_own_request(path):
+    writer = GroupCommitWriter(lambda: sqlite3.connect(path), max_batch=2, max_wait=5)
+
+    first = writer.submit(insert('same'))
+    duplicate = writer.submit(insert('same'))
+
+    assert first.result(timeout=5) == 'same'
+    with pytest.raises(sqlite3.IntegrityError):
+        duplicate.result(timeout=5)
+
+    assert names(path) == ['same']
+
+
+def test_writer_keeps_going_after_connect_fails(path):
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError('unable to open database file')
+        return sqlite3.connect(path)
+
+    writer = GroupCommitWriter(connect, max_batch=1, max_wait=0)
+
+    with pytest.raises(sqlite3.OperationalError):
+        writer.submit(insert('lost')).result(timeout=5)
+
+    # The same thread tries to connect again for the next batch
+    assert writer.submit(insert('saved')).result(timeout=5) == 'saved'
+    assert len(attempts) == 2
+    assert names(path) == ['saved']
+
+
+def test_run_write_uses_the_writer(app):
+    app.config['WRITE_QUEUE'] = True
+    app.extensions['writer'] = writer = GroupCommitWriter(app.extensions['database_pool'].connect)
+
+    def add_user(connection):
+        return connection.execute("INSERT INTO user (username, password) VALUES ('a', 'b')").lastrowid
+
+    with app.app_context():
+        assert run_write(add_user) == 1
+
+    assert writer.writes == 1